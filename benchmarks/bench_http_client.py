@@ -0,0 +1,55 @@
+"""
+Бенчмарк: новий httpx.AsyncClient на кожен виклик (cold) проти спільного пулу (warm)
+Використання: python3.12 benchmarks/bench_http_client.py [кількість викликів]
+
+Заглушка працює по HTTP без TLS, тому реальна різниця з developers.ria.com
+(де додається TLS handshake) буде ще більшою.
+"""
+import asyncio
+import sys
+import time
+
+import httpx
+
+from common import bench_environment, load_server, print_row, summarize
+from stub_server import start_stub
+
+
+async def run_cold(base_url: str, calls: int) -> list:
+    latencies = []
+    for i in range(calls):
+        started = time.perf_counter()
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            resp = await client.get(f"{base_url}/info", params={"api_key": "x", "auto_id": i})
+            resp.json()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def run_warm(server, calls: int) -> list:
+    latencies = []
+    for i in range(calls):
+        started = time.perf_counter()
+        result = await server.get_car_info(i)
+        assert result["success"], result
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def main(calls: int) -> None:
+    stub, base_url = start_stub()
+    bench_environment()
+    server = load_server()
+    server.BASE_URL = base_url
+    server.api_key = "bench"
+
+    print(f"Stub: {base_url}, викликів: {calls}")
+    print_row("cold (client per call)", summarize(await run_cold(base_url, calls)))
+    print_row("warm (shared client)", summarize(await run_warm(server, calls)))
+
+    await server.close_http_client()
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
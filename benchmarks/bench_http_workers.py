@@ -0,0 +1,128 @@
+"""
+Навантажувальний тест мережевого режиму: запити/с залежно від кількості воркерів
+Використання: python3.12 benchmarks/bench_http_workers.py [воркери через кому] [тривалість, с]
+
+Сервер працює з локальною заглушкою AUTO.RIA API, тому вимірюється власна
+пропускна здатність MCP сервера. Клієнти надсилають JSON-RPC tools/call напряму
+(без LLM). Масштабування обмежене кількістю ядер CPU машини.
+"""
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from common import AUTO_RIA_SERVER_PATH, print_row, summarize
+from stub_server import start_stub
+
+CONCURRENCY = 32
+HEADERS = {
+    "Accept": "application/json, text/event-stream",
+    "Content-Type": "application/json",
+    "X-Auto-Ria-Api-Key": "bench",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Сервер не запустився на порту {port}")
+
+
+async def initialize(client: httpx.AsyncClient, url: str) -> dict:
+    """
+    MCP handshake; повертає заголовки для подальших запитів (з mcp-session-id, якщо сервер його видав)
+    """
+    resp = await client.post(url, headers=HEADERS, json={
+        "jsonrpc": "2.0", "id": 0, "method": "initialize",
+        "params": {"protocolVersion": "2025-06-18", "capabilities": {},
+                   "clientInfo": {"name": "bench", "version": "1.0"}},
+    })
+    resp.raise_for_status()
+    headers = dict(HEADERS)
+    session_id = resp.headers.get("mcp-session-id")
+    if session_id:
+        headers["mcp-session-id"] = session_id
+    await client.post(url, headers=headers, json={"jsonrpc": "2.0", "method": "notifications/initialized"})
+    return headers
+
+
+async def run_load(url: str, duration: float) -> list:
+    latencies = []
+    stop_at = time.monotonic() + duration
+
+    async def user(client: httpx.AsyncClient, user_id: int) -> None:
+        headers = await initialize(client, url)
+        request_id = 0
+        while time.monotonic() < stop_at:
+            request_id += 1
+            payload = {
+                "jsonrpc": "2.0", "id": request_id, "method": "tools/call",
+                "params": {"name": "get_car_info",
+                           "arguments": {"auto_id": random.randint(1, 500), "view": "compact"}},
+            }
+            started = time.perf_counter()
+            resp = await client.post(url, json=payload, headers=headers)
+            resp.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+    async with httpx.AsyncClient(timeout=30.0, limits=limits) as client:
+        await asyncio.gather(*(user(client, i) for i in range(CONCURRENCY)))
+    return latencies
+
+
+def bench_workers(workers: int, base_url: str, duration: float) -> None:
+    port = free_port()
+    tmp_dir = tempfile.mkdtemp(prefix="auto_ria_bench_")
+    env = dict(os.environ,
+               AUTO_RIA_BASE_URL=base_url,
+               AUTO_RIA_RATE_PER_SECOND="1000000",
+               AUTO_RIA_RATE_BURST="100000",
+               AUTO_RIA_CACHE_BACKEND="sqlite",
+               AUTO_RIA_CACHE_PATH=os.path.join(tmp_dir, "cache.sqlite3"),
+               AUTO_RIA_STORE_PATH="",
+               AUTO_RIA_REFERENCE_PATH=os.path.join(tmp_dir, "reference.json"))
+    server = subprocess.Popen(
+        [sys.executable, AUTO_RIA_SERVER_PATH, "--transport", "http",
+         "--port", str(port), "--workers", str(workers)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+        time.sleep(1.0)  # воркери стартують незалежно
+        latencies = asyncio.run(run_load(f"http://127.0.0.1:{port}/mcp", duration))
+        print_row(f"workers={workers} rps={len(latencies) / duration:8.1f}", summarize(latencies))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    workers_list = [int(w) for w in (sys.argv[1] if len(sys.argv) > 1 else "1,2,4").split(",")]
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    stub, base_url = start_stub()
+    print(f"Stub: {base_url}, CPU: {os.cpu_count()}, одночасних клієнтів: {CONCURRENCY}")
+    for workers in workers_list:
+        bench_workers(workers, base_url, duration)
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Бенчмарк розбору відповідей /search та /info на записаних фікстурах: час і пам'ять на виклик
+Використання: python3.12 benchmarks/bench_json_decode.py [кількість одночасних відповідей для RSS]
+
+Варіанти:
+  before   - response.json() і повторна серіалізація json.dumps для кешу (як було)
+  after    - decode_json(response.content) (orjson, якщо встановлений) і розмір кешу з тіла відповіді
+  after+ids - after і проєкція search_ids_only, яку кешують компактні виклики /search
+  ijson    - потоковий розбір лише ID з /search (якщо встановлений ijson), для порівняння
+Пам'ять: пік tracemalloc на один виклик і приріст peak RSS процесу, який одночасно тримає
+N розібраних відповідей (кожен варіант у окремому підпроцесі).
+"""
+import io
+import json
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from common import load_server
+from stub_server import FIXTURES_PATH
+
+REPEAT = 2000
+
+
+def load_payloads() -> Dict[str, bytes]:
+    """
+    Тіла відповідей з фікстур; /search розширено до countpage=100 (як у search_cars_all)
+    """
+    with open(FIXTURES_PATH, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    search = next(r["body"] for r in records if r["key"].startswith("/search"))
+    info = next(r["body"] for r in records if r["key"].startswith("/info"))
+    ids = [str(36200000 + i * 137) for i in range(100)]
+    search["result"]["search_result"]["ids"] = ids
+    search["result"]["search_result_common"]["data"] = [{"id": i, "type": "UsedAuto"} for i in ids]
+    # AUTO.RIA віддає кирилицю як \\uXXXX, тому ensure_ascii=True ближче до реальних відповідей
+    return {"search": json.dumps(search).encode(), "info": json.dumps(info).encode()}
+
+
+def make_variants(server: Any) -> Dict[str, Callable[[bytes], Any]]:
+    def before(body: bytes) -> Any:
+        data = json.loads(body)
+        json.dumps(data, ensure_ascii=False)  # ResponseCache.set рахував розмір серіалізацією
+        return data
+
+    def after(body: bytes) -> Any:
+        return server.decode_json(body)
+
+    def after_ids(body: bytes) -> Any:
+        return server.search_ids_only(server.decode_json(body))
+
+    variants = {"before": before, "after": after, "after+ids": after_ids}
+    try:
+        import ijson
+
+        def stream_ids(body: bytes) -> Any:
+            return {"ids": next(ijson.items(io.BytesIO(body), "result.search_result.ids"))}
+
+        variants["ijson"] = stream_ids
+    except ImportError:
+        pass
+    return variants
+
+
+def per_call(fn: Callable[[bytes], Any], body: bytes) -> Dict[str, float]:
+    fn(body)
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        fn(body)
+    elapsed = (time.perf_counter() - started) / REPEAT
+    tracemalloc.start()
+    fn(body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"us": elapsed * 1e6, "peak_kib": peak / 1024}
+
+
+def rss_child(variant: str, payload: str, count: int) -> None:
+    """
+    Режим підпроцесу: тримає count розібраних відповідей і друкує приріст peak RSS у KiB
+    """
+    server = load_server()
+    fn = make_variants(server)[variant]
+    bodies = [load_payloads()[payload].replace(b"36200000", str(36200000 + i).encode()) for i in range(count)]
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results: List[Any] = [fn(body) for body in bodies]
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before, len(results))
+
+
+def main(count: int) -> None:
+    server = load_server()
+    payloads = load_payloads()
+    variants = make_variants(server)
+    server.decode_json(b"{}")
+    print(f"decode_json: {server._json_loads.__module__}; /search {len(payloads['search'])} B, /info {len(payloads['info'])} B")
+    for payload, body in payloads.items():
+        for name, fn in variants.items():
+            if name in ("after+ids", "ijson") and payload != "search":
+                continue
+            stats = per_call(fn, body)
+            out = subprocess.run(
+                [sys.executable, __file__, "--rss", name, payload, str(count)],
+                capture_output=True, text=True, check=True,
+            ).stdout.split()
+            print(f"/{payload:<7} {name:<9} {stats['us']:8.1f} us/виклик  пік {stats['peak_kib']:7.1f} KiB/виклик  "
+                  f"RSS +{int(out[0]) / 1024:6.1f} MiB на {count} відповідей")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--rss":
+        rss_child(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,248 @@
+"""
+Навантажувальний тест MCP сервера без LLM: fastmcp Client по stdio та Streamable HTTP проти заглушки API
+Використання: python3.12 benchmarks/bench_load.py [--transport stdio,http] [--concurrency 16] [--duration 10]
+              [--sessions 1] [--mix search_cars=1,get_car_info=3,get_average_price=1] [--distinct 500]
+              [--latency-ms 50 --jitter-ms 20 --error-rate 0.01 --rate-limit-rate 0.02]
+
+--concurrency одночасних викликів розподіляються між --sessions MCP сесіями. По stdio кожна
+сесія - окремий процес сервера (як у клієнтів з clients/), по HTTP - один процес на всі сесії.
+--distinct задає кількість різних аргументів кожного інструмента (менше - більше попадань у кеш).
+
+Звіт: пропускна здатність, перцентилі латентності за інструментами, помилки, затримка event loop
+генератора навантаження (якщо вона велика, латентності завищені самим генератором), затримка
+event loop сервера і трафік до API з get_server_stats та RSS процесів сервера (поточний і піковий, Linux /proc).
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+from fastmcp import Client
+from fastmcp.client.transports import StdioTransport, StreamableHttpTransport
+
+from bench_http_workers import free_port, wait_for_port
+from bench_tools import is_failure
+from common import AUTO_RIA_SERVER_PATH, bench_environment, percentile, summarize
+from stub_server import FixtureStore, add_fault_arguments, faults_from_args, start_stub
+
+API_KEY = "bench"
+LAG_INTERVAL = 0.01
+RSS_INTERVAL = 0.5
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def make_arguments(tool: str, distinct: int) -> Dict[str, Any]:
+    """
+    Випадкові аргументи виклику з distinct можливих варіантів
+    """
+    n = random.randrange(distinct)
+    if tool == "search_cars":
+        return {"marka_id": [9], "page": n, "countpage": 20, "view": "compact"}
+    if tool == "get_car_info":
+        return {"auto_id": 100000 + n, "view": "compact"}
+    if tool == "get_average_price":
+        return {"marka_id": 9, "model_id": 3219, "yers": 2000 + n % 25, "race_id": n // 25}
+    raise ValueError(f"Невідомий інструмент у --mix: {tool}")
+
+
+def proc_rss_kib(pid: int) -> Tuple[int, int]:
+    """
+    (VmRSS, VmHWM) процесу в KiB; (0, 0), якщо процес уже завершився
+    """
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    values[line.split(":")[0]] = int(line.split()[1])
+    except OSError:
+        pass
+    return values.get("VmRSS", 0), values.get("VmHWM", 0)
+
+
+def server_children() -> List[int]:
+    """
+    PID процесів сервера, запущених цим процесом (stdio транспорт запускає їх сам)
+    """
+    pids = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            with open(f"/proc/{name}/cmdline", "rb") as f:
+                cmdline = f.read()
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == os.getpid() and AUTO_RIA_SERVER_PATH.encode() in cmdline:
+            pids.append(int(name))
+    return pids
+
+
+async def sample_loop_lag(lags: List[float], stop: asyncio.Event) -> None:
+    """
+    Наскільки пізніше запланованого прокидається sleep генератора навантаження
+    """
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - started - LAG_INTERVAL))
+
+
+async def sample_rss(pids_fn: Any, samples: List[int], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        samples.append(sum(proc_rss_kib(pid)[0] for pid in pids_fn()))
+        await asyncio.sleep(RSS_INTERVAL)
+
+
+async def run_load(clients: List[Client], args: argparse.Namespace, pids_fn: Any) -> Dict[str, Any]:
+    weights = parse_mix(args.mix)
+    tools, tool_weights = list(weights), list(weights.values())
+    latencies: Dict[str, List[float]] = {tool: [] for tool in tools}
+    errors: Dict[str, int] = {tool: 0 for tool in tools}
+
+    async def call(client: Client, tool: str) -> Tuple[float, bool]:
+        started = time.perf_counter()
+        try:
+            result = await client.call_tool(tool, make_arguments(tool, args.distinct), raise_on_error=False)
+            failed = result.is_error or is_failure(result.structured_content)
+        except Exception:
+            failed = True
+        return time.perf_counter() - started, failed
+
+    for client in clients:  # прогрів: lazy імпорти, з'єднання, довідники
+        for tool in tools:
+            await call(client, tool)
+
+    stop = asyncio.Event()
+    lags: List[float] = []
+    rss: List[int] = []
+    samplers = [asyncio.ensure_future(sample_loop_lag(lags, stop)),
+                asyncio.ensure_future(sample_rss(pids_fn, rss, stop))]
+    stop_at = time.monotonic() + args.duration
+
+    async def worker(client: Client) -> None:
+        while time.monotonic() < stop_at:
+            tool = random.choices(tools, tool_weights)[0]
+            elapsed, failed = await call(client, tool)
+            latencies[tool].append(elapsed)
+            errors[tool] += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(clients[i % len(clients)]) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*samplers)
+
+    server_stats = await clients[0].call_tool("get_server_stats", {}, raise_on_error=False)
+    return {"latencies": latencies, "errors": errors, "elapsed": elapsed, "lags": lags, "rss": rss,
+            "peak_rss": sum(proc_rss_kib(pid)[1] for pid in pids_fn()),
+            "server": server_stats.structured_content or {}}
+
+
+def report(label: str, result: Dict[str, Any]) -> None:
+    all_latencies = [v for values in result["latencies"].values() for v in values]
+    total_errors = sum(result["errors"].values())
+    print(f"\n[{label}] викликів: {len(all_latencies)}, {len(all_latencies) / result['elapsed']:.1f}/с, "
+          f"помилок: {total_errors}")
+    for tool, values in list(result["latencies"].items()) + [("усі", all_latencies)]:
+        stats = summarize(values)
+        print(f"  {tool:<18} n={stats['n']:<6} p50={stats['p50_ms']:8.2f} ms  "
+              f"p90={percentile(values, 90) * 1000:8.2f} ms  p99={stats['p99_ms']:8.2f} ms  "
+              f"max={stats['max_ms']:8.2f} ms")
+    lags = result["lags"]
+    print(f"  event loop генератора: p99={percentile(lags, 99) * 1000:.2f} ms, "
+          f"max={max(lags, default=0) * 1000:.2f} ms")
+    server_loop = result["server"].get("event_loop")
+    if server_loop:
+        lag = server_loop["lag"]
+        print(f"  event loop сервера: p50={lag['p50_ms']} ms, p99={lag['p99_ms']} ms, max={lag['max_ms']} ms, "
+              f"сплесків: {len(server_loop['spikes'])}, повільних callback-ів: {server_loop['slow_callbacks']}")
+    else:
+        print("  event loop сервера: сервер не повертає event_loop у get_server_stats")
+    bandwidth = result["server"].get("bandwidth")
+    if bandwidth:
+        print(f"  трафік до API: {bandwidth['wire_bytes'] / 1024:.1f} KiB на дроті, "
+              f"{bandwidth['body_bytes'] / 1024:.1f} KiB після розпакування, 304: {bandwidth['not_modified']}, "
+              f"заощаджено {bandwidth['saved_ratio']:.0%}")
+    rss = result["rss"]
+    if rss:
+        print(f"  RSS сервера: {rss[0] / 1024:.1f} -> {rss[-1] / 1024:.1f} MiB, "
+              f"пік {result['peak_rss'] / 1024:.1f} MiB")
+
+
+async def bench_stdio(env: Dict[str, str], args: argparse.Namespace) -> Dict[str, Any]:
+    # stderr серверів (банер, логи) не змішується з результатами
+    log_file = open(os.devnull, "w")
+    clients = [Client(StdioTransport(sys.executable, [AUTO_RIA_SERVER_PATH], env=env, log_file=log_file),
+                      timeout=60)
+               for _ in range(args.sessions)]
+    for client in clients:
+        await client.__aenter__()
+    try:
+        for client in clients:
+            await client.call_tool("set_api_key", {"key": API_KEY})
+        return await run_load(clients, args, server_children)
+    finally:
+        for client in clients:
+            await client.__aexit__(None, None, None)
+        log_file.close()
+
+
+async def bench_http(env: Dict[str, str], args: argparse.Namespace) -> Dict[str, Any]:
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, AUTO_RIA_SERVER_PATH, "--transport", "http", "--port", str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+        url = f"http://127.0.0.1:{port}/mcp"
+        clients = [Client(StreamableHttpTransport(url, headers={"X-Auto-Ria-Api-Key": API_KEY}), timeout=60)
+                   for _ in range(args.sessions)]
+        for client in clients:
+            await client.__aenter__()
+        try:
+            return await run_load(clients, args, lambda: [server.pid])
+        finally:
+            for client in clients:
+                await client.__aexit__(None, None, None)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def main(args: argparse.Namespace) -> None:
+    random.seed(args.seed)
+    stub, base_url = start_stub(fixtures=FixtureStore(), faults=faults_from_args(args))
+    env = dict(os.environ, **bench_environment(base_url))
+    print(f"Stub: {base_url}, CPU: {os.cpu_count()}, одночасних викликів: {args.concurrency}, "
+          f"сесій: {args.sessions}, суміш: {args.mix}")
+    for transport in args.transport.split(","):
+        runner = {"stdio": bench_stdio, "http": bench_http}[transport]
+        report(transport, await runner(env, args))
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Навантажувальний тест AUTO.RIA MCP сервера")
+    parser.add_argument("--transport", default="stdio,http", help="stdio, http або обидва через кому")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="тривалість заміру, с")
+    parser.add_argument("--sessions", type=int, default=1, help="кількість MCP сесій (клієнтів)")
+    parser.add_argument("--mix", default="search_cars=1,get_car_info=3,get_average_price=1")
+    parser.add_argument("--distinct", type=int, default=500, help="різних аргументів на інструмент")
+    add_fault_arguments(parser)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,35 @@
+"""
+Бенчмарк: market_stats (NumPy) на синтетичних оголошеннях
+Використання: python3.12 benchmarks/bench_market_stats.py [кількість оголошень]
+"""
+import sys
+import time
+
+import numpy as np
+
+from common import load_server
+
+
+def main(count: int, repeat: int = 5) -> None:
+    server = load_server()
+    rng = np.random.default_rng(42)
+    ids = np.arange(count, dtype=float)
+    years = rng.integers(2000, 2024, count).astype(float)
+    mileages = rng.integers(0, 400, count).astype(float)
+    regions = rng.integers(1, 26, count).astype(float)
+    prices = 40000 - (2024 - years) * 1200 - mileages * 20 + rng.normal(0, 2000, count)
+    prices[rng.random(count) < 0.01] = np.nan
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        stats = server.compute_market_stats(ids, prices, years, mileages, regions)
+        timings.append(time.perf_counter() - started)
+
+    print(f"Оголошень: {count}, груп за роками: {len(stats['by_year'])}, "
+          f"за областями: {len(stats['by_state'])}, викидів: {stats['outliers']['count']}")
+    print(f"compute_market_stats: min {min(timings) * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
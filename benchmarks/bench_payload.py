@@ -0,0 +1,41 @@
+"""
+Бенчмарк: розмір відповіді та час серіалізації для view="full" / "compact" / "columnar"
+Використання: python3.12 benchmarks/bench_payload.py [кількість оголошень]
+"""
+import json
+import sys
+import time
+
+from common import load_server
+from stub_server import make_listing
+
+
+def measure(build, repeat: int = 50):
+    payload = b""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        payload = json.dumps(build(), ensure_ascii=False).encode()
+    return len(payload), (time.perf_counter() - started) / repeat
+
+
+def main(count: int) -> None:
+    server = load_server()
+    listings = [make_listing(1000 + i) for i in range(count)]
+    fields = server.resolve_fields("compact", None)
+
+    variants = {
+        "full": lambda: {str(i): info for i, info in enumerate(listings)},
+        "compact": lambda: {str(i): server.project_listing(info, fields) for i, info in enumerate(listings)},
+        "columnar": lambda: server.to_columnar(listings, fields),
+    }
+
+    print(f"Оголошень: {count}")
+    base = None
+    for name, build in variants.items():
+        size, seconds = measure(build)
+        base = base or size
+        print(f"{name:<10} {size:>10} B  ({size / base:6.1%})  {seconds * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
@@ -0,0 +1,74 @@
+"""
+Бенчмарк: refine_listings (ListingTable на NumPy) на синтетичних оголошеннях
+Використання: python3.12 benchmarks/bench_refine.py [кількість оголошень]
+
+Окремо міряється побудова таблиці з рядків сховища (виконується лише після змін у сховищі)
+і самі запити: фільтр + сортування, top-k за оцінкою, дедуплікація повторно виставлених авто.
+"""
+import sys
+import time
+
+import numpy as np
+
+from common import load_server
+
+CITIES = ["Київ", "Львів", "Одеса", "Харків", "Дніпро", "Вінниця", "Полтава", "Черкаси"]
+
+QUERIES = {
+    "filter+sort": dict(
+        where=[{"field": "price_usd", "op": "<=", "value": 25000},
+               {"field": "city", "op": "in", "value": ["Київ", "Львів"]}],
+        sort_by=["-year", "price_usd"], dedupe=False),
+    "top-k score": dict(score={"price_usd": -1, "mileage": -0.5, "year": 1}, dedupe=False),
+    "contains+dedupe": dict(where=[{"field": "title", "op": "contains", "value": "x5"}], sort_by=["price_usd"]),
+    "all (dedupe+score)": dict(
+        where=[{"field": "year", "op": ">=", "value": 2012}],
+        score={"price_usd": -1, "mileage": -0.5, "year": 1}),
+}
+
+
+def make_rows(count: int) -> list:
+    """
+    Рядки як з ListingStore.load_columns(STORE_COLUMNS): auto_id, price, year, mileage, city, title,
+    marka, model, state; ~5% - повторно виставлені копії інших оголошень
+    """
+    rng = np.random.default_rng(42)
+    years = rng.integers(2000, 2024, count)
+    mileages = rng.integers(0, 400, count)
+    prices = np.maximum(1000, 40000 - (2024 - years) * 1200 - mileages * 20 + rng.normal(0, 2000, count))
+    models = rng.integers(0, 40, count)
+    cities = rng.integers(0, len(CITIES), count)
+    rows = []
+    for i in range(count):
+        source = i if rng.random() > 0.05 or i == 0 else int(rng.integers(0, i))
+        rows.append((
+            30000000 + i, int(prices[i]), int(years[source]), int(mileages[source]), CITIES[cities[source]],
+            f"BMW X{models[source] % 7 + 1} {years[source]}", 9, int(3200 + models[source]),
+            int(cities[source]) + 1,
+        ))
+    return rows
+
+
+def timed(fn, repeat: int = 10) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main(count: int) -> None:
+    server = load_server()
+    rows = make_rows(count)
+    build_ms = timed(lambda: server.ListingTable(rows), repeat=3)
+    table = server.ListingTable(rows)
+    print(f"Оголошень: {count}, побудова ListingTable: {build_ms:.1f} ms")
+    for name, query in QUERIES.items():
+        result = server.refine_table(table, limit=50, **query)
+        ms = timed(lambda: server.refine_table(table, limit=50, **query))
+        print(f"{name:<20} {ms:7.2f} ms  знайдено {result['matched']}, дублікатів {result['duplicates_removed']}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
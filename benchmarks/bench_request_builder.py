@@ -0,0 +1,60 @@
+"""
+Мікробенчмарк: побудова параметрів /search - старий підхід проти SearchQueryEncoder
+Використання: python3.12 benchmarks/bench_request_builder.py [кількість побудов]
+"""
+import sys
+import time
+
+from common import load_server
+
+VALUES = {
+    "category_id": 1, "page": 0, "countpage": 20, "currency": 1,
+    "price_ot": 5000, "price_do": 25000, "verified": 1, "raceInt_do": 200,
+    "s_yers": [2010, 2015], "po_yers": [2014, 2020],
+    "marka_id": [9, 48], "model_id": [3219, 410], "city_id": [10], "gear_id": [2],
+}
+SCALARS = ("price_ot", "price_do", "currency", "auctionPossible", "exchangePossible",
+           "with_exchange_type", "credit_possible", "under_credit", "confiscated_car",
+           "custom_cleared", "auto_id", "engineVolume_ot", "engineVolume_do", "power_ot",
+           "power_do", "raceInt_ot", "raceInt_do", "verified")
+ARRAYS = ("s_yers", "po_yers", "marka_id", "model_id", "city_id", "state_id",
+          "gear_id", "drive_id", "fuel_id", "bodystyle_id", "color_id")
+
+
+def legacy_build(values):
+    """
+    Попередня реалізація: scalar_map + фільтр + add_array_params для кожного спискового поля
+    """
+    params = {"api_key": "x", "category_id": values["category_id"], "page": values["page"],
+              "countpage": min(values["countpage"], 100)}
+    scalar_map = {name: values.get(name) for name in SCALARS}
+    if scalar_map["currency"] == 1:
+        scalar_map["currency"] = None
+    params.update({k: v for k, v in scalar_map.items() if v is not None})
+    for name in ARRAYS:
+        items = values.get(name)
+        if items:
+            for idx, val in enumerate(items):
+                params[f"{name}[{idx}]"] = val
+    # для кешу параметри все одно доводилось нормалізувати
+    return tuple(sorted((k, str(v)) for k, v in params.items() if k != "api_key"))
+
+
+def run(label, build, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        build(VALUES)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<22} {count / elapsed:>12,.0f} побудов/с  {elapsed / count * 1e6:7.2f} мкс/побудова")
+
+
+def main(count: int) -> None:
+    server = load_server()
+    encoder = server.SEARCH_QUERY_ENCODER
+    assert legacy_build(VALUES) == encoder.encode(VALUES)
+    run("legacy (dict + sort)", legacy_build, count)
+    run("SearchQueryEncoder", encoder.encode, count)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
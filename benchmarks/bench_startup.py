@@ -0,0 +1,93 @@
+"""
+Холодний старт MCP серверів: час від запуску процесу до першої відповіді tools/list
+Використання: python3.12 benchmarks/bench_startup.py [запусків] [поріг p50, с]
+
+Сервер запускається по stdio так само, як його запускає клієнт
+(clients/pydantic_ai_auto_ria_search.py): initialize -> notifications/initialized -> tools/list.
+Якщо медіана для будь-якого сервера перевищує поріг, скрипт завершується з кодом 1,
+тож його можна використовувати як перевірку регресій у CI.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import AUTO_RIA_SERVER_PATH, EXAMPLE_SERVER_PATH, print_row, summarize
+
+DEFAULT_RUNS = 5
+DEFAULT_THRESHOLD_S = 3.0
+
+INITIALIZE = {
+    "jsonrpc": "2.0", "id": 0, "method": "initialize",
+    "params": {"protocolVersion": "2025-06-18", "capabilities": {},
+               "clientInfo": {"name": "bench", "version": "1.0"}},
+}
+INITIALIZED = {"jsonrpc": "2.0", "method": "notifications/initialized"}
+TOOLS_LIST = {"jsonrpc": "2.0", "id": 1, "method": "tools/list"}
+
+
+def read_response(proc: subprocess.Popen, request_id: int) -> dict:
+    """
+    Читає рядки stdout, доки не прийде відповідь з потрібним id
+    """
+    while True:
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError("Сервер завершився до відповіді")
+        message = json.loads(line)
+        if message.get("id") == request_id:
+            return message
+
+
+def time_to_tools_list(path: str, env: dict) -> tuple:
+    """
+    Повертає (секунди до відповіді tools/list, кількість інструментів)
+    """
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, path], env=env, text=True,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    try:
+        for message in (INITIALIZE, INITIALIZED, TOOLS_LIST):
+            proc.stdin.write(json.dumps(message) + "\n")
+        proc.stdin.flush()
+        read_response(proc, INITIALIZE["id"])
+        tools = read_response(proc, TOOLS_LIST["id"])["result"]["tools"]
+        return time.perf_counter() - started, len(tools)
+    finally:
+        proc.stdin.close()
+        proc.terminate()
+        proc.wait()
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RUNS
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_THRESHOLD_S
+    tmp_dir = tempfile.mkdtemp(prefix="auto_ria_bench_")
+    # Без мережі та файлів у робочому каталозі: довідники і сховище в тимчасовій теці
+    env = dict(os.environ,
+               AUTO_RIA_BASE_URL="http://127.0.0.1:9",
+               AUTO_RIA_REFERENCE_PATH=os.path.join(tmp_dir, "reference.json"),
+               AUTO_RIA_STORE_PATH="")
+
+    failed = False
+    for label, path in (("mcp-server-example", EXAMPLE_SERVER_PATH),
+                        ("mcp-server-auto-ria-search", AUTO_RIA_SERVER_PATH)):
+        latencies = []
+        tools_count = 0
+        for _ in range(runs):
+            elapsed, tools_count = time_to_tools_list(path, env)
+            latencies.append(elapsed)
+        stats = summarize(latencies)
+        print_row(f"{label} ({tools_count} tools)", stats)
+        if stats["p50_ms"] > threshold * 1000:
+            print(f"  РЕГРЕСІЯ: p50 {stats['p50_ms']:.0f} ms > поріг {threshold * 1000:.0f} ms")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Набір бенчмарків інструментів AUTO.RIA сервера на заглушці API з записаними фікстурами
+Використання: python3.12 benchmarks/bench_tools.py [--calls 200] [--concurrency 8] [--only get_car_info,search_cars]
+              [--latency-ms 50 --jitter-ms 20 --error-rate 0.02 --rate-limit-rate 0.05]
+              [--save baseline.json] [--compare baseline.json --tolerance 0.25]
+
+Для кожного інструмента: пропускна здатність (викликів/с при заданій кількості одночасних
+викликів), перцентилі латентності та пікова пам'ять Python (tracemalloc, окремий прохід).
+Аргументи викликів різні, тож кожен виклик - промах кешу і справжній запит до заглушки.
+З --compare скрипт завершується з кодом 1, якщо p50 чи пам'ять зросли, або пропускна
+здатність впала більше ніж на tolerance відносно збереженого запуску.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from common import bench_environment, load_server, summarize
+from stub_server import FIXTURES_PATH, FixtureStore, add_fault_arguments, faults_from_args, start_stub
+
+MEMORY_CALLS = 50
+FILTERS = {"marka_id": [9], "model_id": [3219]}
+
+
+async def call_sync(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Синхронний інструмент як корутина (без зайвого перемикання event loop всередині заміру)
+    """
+    return fn(*args, **kwargs)
+
+
+def build_cases(server: Any) -> List[Tuple[str, Callable[[int], Awaitable[Any]]]]:
+    """
+    (назва, виклик за номером ітерації); порядок важливий: локальні інструменти працюють
+    зі сховищем, яке заповнює sync_listings
+    """
+    return [
+        ("search_cars", lambda i: server.search_cars(marka_id=[9], model_id=[3219], page=i, view="compact")),
+        ("search_cars_all", lambda i: server.search_cars_all(
+            filters=dict(FILTERS, price_ot=i), max_results=200, countpage=100)),
+        ("get_car_info", lambda i: server.get_car_info(100000 + i, view="compact")),
+        ("get_cars_info", lambda i: server.get_cars_info(
+            [200000 + i * 20 + k for k in range(20)], view="compact")),
+        ("get_average_price", lambda i: server.get_average_price(9, 3219, 2018, race_id=i)),
+        ("get_average_price_matrix", lambda i: server.get_average_price_matrix(
+            [{"marka_id": 9, "model_id": 3219}, {"marka_id": 79, "model_id": 698}],
+            years=[1000 + i * 3, 1001 + i * 3, 1002 + i * 3], gear_ids=[1, 2])),
+        ("resolve_ids", lambda i: server.resolve_ids(marka="BMW", model="X5", state="Київська", city="Київ")),
+        ("sync_listings", lambda i: server.sync_listings(filters=dict(FILTERS, price_ot=i), max_results=100)),
+        ("query_listings", lambda i: call_sync(server.query_listings, price_min=i, limit=50)),
+        ("market_stats", lambda i: call_sync(server.market_stats, marka_id=9)),
+    ]
+
+
+def is_failure(result: Any) -> bool:
+    return isinstance(result, dict) and (result.get("success") is False or "error" in result)
+
+
+async def run_calls(call: Callable[[int], Awaitable[Any]], offset: int, calls: int,
+                    concurrency: int) -> Tuple[List[float], int, float]:
+    """
+    Виконує calls викликів не більше concurrency одночасно; (латентності, помилки, тривалість)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async def one(i: int) -> None:
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            result = await call(offset + i)
+            latencies.append(time.perf_counter() - started)
+            failures += is_failure(result)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return latencies, failures, time.perf_counter() - started
+
+
+async def bench_case(call: Callable[[int], Awaitable[Any]], calls: int, concurrency: int) -> Dict[str, float]:
+    await call(-1)  # прогрів: з'єднання, довідники, lazy імпорти
+    latencies, failures, elapsed = await run_calls(call, 0, calls, concurrency)
+    stats = summarize(latencies)
+    stats["rps"] = calls / elapsed
+    stats["errors"] = failures
+
+    tracemalloc.start()
+    await run_calls(call, calls, min(calls, MEMORY_CALLS), concurrency)
+    stats["peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    return stats
+
+
+def print_stats(name: str, stats: Dict[str, float]) -> None:
+    print(f"{name:<26} {stats['rps']:9.1f}/s  p50={stats['p50_ms']:8.2f} ms  p99={stats['p99_ms']:8.2f} ms  "
+          f"peak={stats['peak_kib']:9.1f} KiB  errors={stats['errors']}")
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            tolerance: float) -> List[str]:
+    """
+    Список регресій відносно збереженого запуску
+    """
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if stats["p50_ms"] > base["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {base['p50_ms']:.2f} -> {stats['p50_ms']:.2f} ms")
+        if stats["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {base['rps']:.1f} -> {stats['rps']:.1f} викликів/с")
+        if stats["peak_kib"] > base["peak_kib"] * (1 + tolerance):
+            regressions.append(f"{name}: пам'ять {base['peak_kib']:.0f} -> {stats['peak_kib']:.0f} KiB")
+    return regressions
+
+
+async def main(args: argparse.Namespace) -> int:
+    stub, base_url = start_stub(fixtures=FixtureStore(args.fixtures), faults=faults_from_args(args))
+    bench_environment(base_url)
+    server = load_server()
+    server.api_key = "bench"
+
+    only = set(args.only.split(",")) if args.only else None
+    print(f"Stub: {base_url}, викликів: {args.calls}, одночасно: {args.concurrency}")
+    results: Dict[str, Dict[str, float]] = {}
+    for name, call in build_cases(server):
+        if only and name not in only:
+            continue
+        server.response_cache.clear()
+        results[name] = await bench_case(call, args.calls, args.concurrency)
+        print_stats(name, results[name])
+
+    await server.close_http_client()
+    stub.shutdown()
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"РЕГРЕСІЯ {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарки інструментів AUTO.RIA сервера")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--only", default="", help="назви інструментів через кому")
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    parser.add_argument("--save", default="", help="зберегти результати в JSON")
+    parser.add_argument("--compare", default="", help="порівняти з раніше збереженим JSON")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    add_fault_arguments(parser)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,71 @@
+"""
+Спільні утиліти для бенчмарків MCP серверів
+"""
+import importlib.util
+import os
+import tempfile
+from typing import Any, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUTO_RIA_SERVER_PATH = os.path.join(ROOT_DIR, "servers", "mcp-server-auto-ria-search.py")
+EXAMPLE_SERVER_PATH = os.path.join(ROOT_DIR, "servers", "mcp-server-example.py")
+
+
+def bench_environment(base_url: Optional[str] = None) -> Dict[str, str]:
+    """
+    Змінні оточення сервера для бенчмарків: без лімітів запитів і без файлів у робочому каталозі.
+    Застосовуються до os.environ (для load_server) і повертаються для запуску підпроцесів
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="auto_ria_bench_")
+    env = {
+        "AUTO_RIA_RATE_PER_SECOND": "1000000",
+        "AUTO_RIA_RATE_BURST": "100000",
+        "AUTO_RIA_CACHE_BACKEND": "memory",
+        "AUTO_RIA_CACHE_PATH": os.path.join(tmp_dir, "cache.sqlite3"),
+        "AUTO_RIA_STORE_PATH": os.path.join(tmp_dir, "listings.sqlite3"),
+        "AUTO_RIA_REFERENCE_PATH": os.path.join(tmp_dir, "reference.json"),
+    }
+    if base_url:
+        env["AUTO_RIA_BASE_URL"] = base_url
+    os.environ.update(env)
+    return env
+
+
+def load_server(path: str = AUTO_RIA_SERVER_PATH, name: str = "auto_ria_server") -> Any:
+    """
+    Імпортує файл сервера як модуль (ім'я файлу містить дефіси, тому звичайний import не працює)
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Перцентиль q (0-100) з лінійною інтерполяцією
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """
+    Зведення латентностей (секунди) у мілісекундах
+    """
+    return {
+        "n": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": (max(latencies) if latencies else 0.0) * 1000,
+    }
+
+
+def print_row(label: str, stats: Dict[str, float]) -> None:
+    print(f"{label:<28} n={stats['n']:<6} p50={stats['p50_ms']:8.2f} ms  "
+          f"p99={stats['p99_ms']:8.2f} ms  max={stats['max_ms']:8.2f} ms")
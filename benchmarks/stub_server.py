@@ -0,0 +1,350 @@
+"""
+Локальна заглушка AUTO.RIA API для бенчмарків (без мережі та API ключа)
+Використання:
+python3.12 benchmarks/stub_server.py --port 8765 --latency-ms 80 --jitter-ms 40 --error-rate 0.02 --rate-limit-rate 0.05
+AUTO_RIA_BASE_URL=http://127.0.0.1:8765/auto python3.12 servers/mcp-server-auto-ria-search.py
+
+Запис фікстур з реального API (відповіді дописуються у benchmarks/fixtures/auto_ria.jsonl):
+python3.12 benchmarks/stub_server.py --record --api-key ВАШ_КЛЮЧ
+
+Відповіді беруться з записаних фікстур: спершу точний збіг шляху та параметрів,
+далі будь-яка фікстура цього ендпоінта (для /info з підставленим autoId),
+і лише потім синтетичні дані. Затримка, помилки 503 та 429 з Retry-After
+додаються випадково з заданою ймовірністю.
+Успішні відповіді мають ETag (на If-None-Match з тим самим ETag - 304 без тіла)
+і стискаються gzip, якщо клієнт його приймає.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "auto_ria.jsonl")
+UPSTREAM_URL = "https://developers.ria.com/auto"
+GZIP_MIN_BYTES = 256
+
+
+def make_listing(auto_id: int) -> Dict[str, Any]:
+    """
+    Оголошення у форматі відповіді /info (зі скороченим набором полів)
+    """
+    year = 2005 + auto_id % 18
+    return {
+        "USD": 10000 + auto_id % 30000,
+        "UAH": (10000 + auto_id % 30000) * 41,
+        "EUR": int((10000 + auto_id % 30000) * 0.92),
+        "title": f"BMW X5 {year}",
+        "markName": "BMW",
+        "modelName": "X5",
+        "markId": 9,
+        "modelId": 3219,
+        "locationCityName": "Київ",
+        "stateData": {"name": "Київська", "stateId": 10, "cityId": 10, "regionName": "Київська обл."},
+        "autoData": {
+            "autoId": auto_id,
+            "year": year,
+            "raceInt": 50 + auto_id % 300,
+            "fuelName": "Дизель, 3 л.",
+            "gearboxName": "Автомат",
+            "description": "Автомобіль у доброму стані, повна сервісна історія. " * 8,
+            "bodyId": 5,
+            "active": True,
+        },
+        "photoData": {
+            "count": 20,
+            "seoLinkM": f"https://cdn.riastatic.com/photosnew/auto/photo/bmw_x5__{auto_id}m.jpg",
+            "all": list(range(auto_id * 10, auto_id * 10 + 20)),
+        },
+        "linkToView": f"/auto_bmw_x5_{auto_id}.html",
+        "addDate": "2024-05-01 12:00:00",
+        "updateDate": "2024-05-20 08:30:00",
+    }
+
+
+def _ref(*pairs: Tuple[str, int]) -> List[Dict[str, Any]]:
+    return [{"name": name, "value": value} for name, value in pairs]
+
+
+# Довідники у форматі AUTO.RIA ([{"name": ..., "value": ...}])
+REFERENCE_DATA: Dict[str, List[Dict[str, Any]]] = {
+    "/categories/1/marks": _ref(("Audi", 6), ("BMW", 9), ("Mercedes-Benz", 48), ("Toyota", 79), ("Volkswagen", 84)),
+    "/categories/1/marks/9/models": _ref(("X5", 3219), ("X3", 3213), ("3 Series", 3177), ("5 Series", 3179)),
+    "/states": _ref(("Київська", 10), ("Львівська", 5), ("Харківська", 7)),
+    "/states/10/cities": _ref(("Київ", 10), ("Бровари", 178)),
+    "/states/5/cities": _ref(("Львів", 5), ("Дрогобич", 54)),
+    "/states/7/cities": _ref(("Харків", 7),),
+    "/type": _ref(("Бензин", 1), ("Дизель", 2), ("Газ", 3), ("Гібрид", 5), ("Електро", 6)),
+    "/categories/1/bodystyles": _ref(("Седан", 3), ("Позашляховик / Кросовер", 5), ("Універсал", 2)),
+    "/colors": _ref(("Білий", 15), ("Чорний", 2), ("Сірий", 8)),
+    "/categories/1/gearboxes": _ref(("Ручна / Механіка", 1), ("Автомат", 2), ("Типтронік", 3)),
+    "/categories/1/driverTypes": _ref(("Передній", 1), ("Задній", 2), ("Повний", 3)),
+}
+
+
+def fixture_key(path: str, query: Dict[str, list]) -> str:
+    """
+    Ключ запису: шлях без префікса /auto та відсортовані параметри без api_key
+    """
+    if path.startswith("/auto"):
+        path = path[len("/auto"):]
+    params = sorted((k, v) for k, values in query.items() if k != "api_key" for v in values)
+    return f"{path}?{urlencode(params)}"
+
+
+class FixtureStore:
+    """
+    Записані відповіді API у JSONL файлі: {"key": ..., "status": ..., "body": ...} на рядок
+    """
+
+    def __init__(self, path: str = FIXTURES_PATH):
+        self.path = path
+        self.exact: Dict[str, Tuple[int, Any]] = {}
+        self.by_endpoint: Dict[str, List[Any]] = {}
+        self._counter = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._add(json.loads(line))
+
+    def _add(self, record: Dict[str, Any]) -> None:
+        key = record["key"]
+        self.exact[key] = (record["status"], record["body"])
+        if record["status"] == 200:
+            self.by_endpoint.setdefault(key.split("?", 1)[0], []).append(record["body"])
+
+    def lookup(self, path: str, query: Dict[str, list]) -> Optional[Tuple[int, Any]]:
+        key = fixture_key(path, query)
+        if key in self.exact:
+            return self.exact[key]
+        endpoint = key.split("?", 1)[0]
+        bodies = self.by_endpoint.get(endpoint)
+        if not bodies:
+            return None
+        if endpoint == "/info":
+            # Будь-яке записане оголошення, але з запитаним ID, щоб ID у відповідях не повторювались
+            auto_id = int(query.get("auto_id", ["0"])[0])
+            body = json.loads(json.dumps(bodies[auto_id % len(bodies)]))
+            body.setdefault("autoData", {})["autoId"] = auto_id
+            return 200, body
+        with self._lock:
+            self._counter += 1
+            return 200, bodies[self._counter % len(bodies)]
+
+    def record(self, path: str, query: Dict[str, list], status: int, body: Any) -> None:
+        record = {"key": fixture_key(path, query), "status": status, "body": body}
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._add(record)
+
+
+class FaultConfig:
+    """
+    Штучна затримка та збої відповіді заглушки
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self) -> Tuple[float, Optional[int]]:
+        """
+        (затримка в секундах, статус збою або None)
+        """
+        with self._lock:
+            delay = (self.latency_ms + self._random.uniform(0, self.jitter_ms)) / 1000
+            roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            return delay, 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return delay, 503
+        return delay, None
+
+
+def synthetic_route(path: str, query: Dict[str, list]) -> Tuple[int, Any]:
+    """
+    Повертає (статус, тіло) для шляхів /auto/search, /auto/info, /auto/average_price та довідників
+    """
+    reference = REFERENCE_DATA.get(path[len("/auto"):] if path.startswith("/auto") else path)
+    if reference is not None:
+        return 200, reference
+    if path.endswith("/search"):
+        page = int(query.get("page", ["0"])[0])
+        countpage = int(query.get("countpage", ["20"])[0])
+        start = page * countpage
+        ids = [str(1000 + i) for i in range(start, start + countpage)]
+        return 200, {"result": {"search_result": {"ids": ids, "count": 1000}}, "count": 1000}
+    if path.endswith("/info"):
+        auto_id = int(query.get("auto_id", ["0"])[0])
+        return 200, make_listing(auto_id)
+    if path.endswith("/average_price"):
+        return 200, {"total": 120, "arithmeticMean": 15230.5, "interQuartileMean": 14900.0,
+                     "percentiles": {"25.0": 11000, "50.0": 14800, "75.0": 18900}}
+    return 404, {"error": "not found"}
+
+
+def route(path: str, query: Dict[str, list], fixtures: Optional[FixtureStore] = None) -> Tuple[int, Any]:
+    """
+    Відповідь з фікстур, а за їх відсутності - синтетична
+    """
+    if fixtures is not None:
+        recorded = fixtures.lookup(path, query)
+        if recorded is not None:
+            return recorded
+    return synthetic_route(path, query)
+
+
+def fetch_real(path: str, raw_query: str, upstream: str, api_key: str) -> Tuple[int, Any]:
+    """
+    Запит до реального API для режиму запису (ключ підставляється тут, у фікстури не потрапляє)
+    """
+    suffix = path[len("/auto"):] if path.startswith("/auto") else path
+    query = parse_qs(raw_query)
+    query["api_key"] = [api_key]
+    url = f"{upstream}{suffix}?{urlencode(query, doseq=True)}"
+    try:
+        with urllib.request.urlopen(url, timeout=30) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, {"error": e.reason}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1, щоб клієнт міг перевикористовувати з'єднання (keep-alive)
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    # Налаштовуються в start_stub для кожного сервера окремо (див. make_handler)
+    fixtures: Optional[FixtureStore] = None
+    faults: FaultConfig = FaultConfig()
+    record_upstream: Optional[str] = None
+    record_api_key: Optional[str] = None
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        extra_headers = {}
+        if self.record_upstream:
+            status, body = fetch_real(url.path, url.query, self.record_upstream, self.record_api_key)
+            if status == 200:
+                self.fixtures.record(url.path, query, status, body)
+        else:
+            delay, fault = self.faults.draw()
+            if delay:
+                time.sleep(delay)
+            if fault == 429:
+                status, body = 429, {"error": "Too Many Requests"}
+                extra_headers["Retry-After"] = f"{self.faults.retry_after:g}"
+            elif fault is not None:
+                status, body = fault, {"error": "Service Unavailable"}
+            else:
+                status, body = route(url.path, query, self.fixtures)
+        payload = json.dumps(body).encode()
+        if status == 200:
+            etag = f'"{hashlib.sha1(payload).hexdigest()[:20]}"'
+            extra_headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                status, payload = 304, b""
+            elif "gzip" in self.headers.get("Accept-Encoding", "") and len(payload) >= GZIP_MIN_BYTES:
+                payload = gzip.compress(payload, compresslevel=6)
+                extra_headers["Content-Encoding"] = "gzip"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in extra_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def start_stub(
+    port: int = 0,
+    fixtures: Optional[FixtureStore] = None,
+    faults: Optional[FaultConfig] = None,
+    record_upstream: Optional[str] = None,
+    record_api_key: Optional[str] = None,
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Запускає заглушку у фоновому потоці і повертає (сервер, базовий URL)
+    """
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "fixtures": fixtures,
+        "faults": faults or FaultConfig(),
+        "record_upstream": record_upstream,
+        "record_api_key": record_api_key,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, real_port = server.server_address[:2]
+    return server, f"http://{host}:{real_port}/auto"
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Спільні параметри збоїв для заглушки та бенчмарків
+    """
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="затримка кожної відповіді")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="додаткова випадкова затримка 0..jitter")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="частка відповідей 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="частка відповідей 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After для 429, с")
+    parser.add_argument("--seed", type=int, default=None, help="seed для відтворюваних збоїв")
+
+
+def faults_from_args(args: argparse.Namespace) -> FaultConfig:
+    return FaultConfig(args.latency_ms, args.jitter_ms, args.error_rate,
+                       args.rate_limit_rate, args.retry_after, args.seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Заглушка AUTO.RIA API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixtures", default=FIXTURES_PATH, help="JSONL файл фікстур")
+    parser.add_argument("--no-fixtures", action="store_true", help="лише синтетичні відповіді")
+    parser.add_argument("--record", action="store_true", help="проксувати запити в реальний API і записувати фікстури")
+    parser.add_argument("--upstream", default=UPSTREAM_URL)
+    parser.add_argument("--api-key", default=os.getenv("AUTO_RIA_API_KEY"))
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    if args.record and not args.api_key:
+        parser.error("--record потребує --api-key або AUTO_RIA_API_KEY")
+
+    fixtures = None if args.no_fixtures and not args.record else FixtureStore(args.fixtures)
+    server, base_url = start_stub(
+        args.port, fixtures, faults_from_args(args),
+        record_upstream=args.upstream if args.record else None,
+        record_api_key=args.api_key,
+    )
+    mode = "запис" if args.record else f"фікстур: {len(fixtures.exact) if fixtures else 0}"
+    print(f"AUTO.RIA stub: {base_url} ({mode})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
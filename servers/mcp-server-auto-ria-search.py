@@ -1,392 +1,3437 @@
 """
 AUTO.RIA MCP Server для пошуку автомобільних оголошень
 Використання: fastmcp run servers/mcp-server-auto-ria-search.py
+
+Мережевий режим (Streamable HTTP, кілька процесів зі спільним кешем):
+python3.12 servers/mcp-server-auto-ria-search.py --transport http --port 8000 --workers 4
 """
 
-from fastmcp import FastMCP
-import httpx
+from fastmcp import FastMCP, Context
+from fastmcp.server.dependencies import get_context, get_http_headers
+from fastmcp.server.middleware import Middleware, MiddlewareContext
 import asyncio
-from typing import Optional, List, Dict, Any
+import bisect
+import hashlib
+import heapq
+import itertools
+import os
+import random
+import re
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, aclosing, contextmanager, nullcontext
+import contextvars
+from contextvars import ContextVar
+from functools import wraps
+from typing import TYPE_CHECKING, Optional, List, Dict, Any, Tuple, Callable, Awaitable, AsyncIterator, Iterator
+from urllib.parse import urlencode
 import json
 
-mcp = FastMCP("AUTO.RIA Search Server 🚗")
+# Сервер запускається клієнтом по stdio на кожну сесію, тому модулі, які потрібні лише
+# під час виклику інструментів (httpx, sqlite3, difflib, email.utils), імпортуються
+# всередині функцій: старт до першої відповіді tools/list не платить за їх завантаження.
+# json та asyncio fastmcp завантажує й сам, відкладати їх немає сенсу.
+if TYPE_CHECKING:
+    import httpx
+    import socket
+    import sqlite3
 
-# Глобальна змінна для зберігання API ключа
+# Глобальна змінна для зберігання API ключа: stdio та in-memory транспорт (один клієнт на процес)
+# і прямий виклик функцій; SSE сесії мають власні ключі - див. set_api_key
 api_key: Optional[str] = None
 
+# API ключі окремих SSE сесій: один процес обслуговує кількох клієнтів без перетину ключів.
+# По Streamable HTTP ID сесії не стабільний між запитами, тож ключ передається лише в заголовку
+API_KEY_HEADER = "x-auto-ria-api-key"
+SESSION_KEYS_MAX = int(os.getenv("AUTO_RIA_MAX_SESSIONS", "10000"))
+session_api_keys: "OrderedDict[str, str]" = OrderedDict()
+# Ключ фонової задачі (опитування збережених пошуків), яка виконується поза запитом клієнта
+background_api_key: ContextVar[Optional[str]] = ContextVar("background_api_key", default=None)
+
+
+def current_session_id() -> Optional[str]:
+    """
+    ID поточної MCP сесії або None поза запитом
+    """
+    try:
+        return get_context().session_id
+    except RuntimeError:
+        return None
+
+
+def current_transport() -> Optional[str]:
+    """
+    Транспорт поточного запиту ("stdio", "sse", "streamable-http") або None поза запитом
+    """
+    try:
+        return get_context().transport
+    except RuntimeError:
+        return None
+
+
+def get_api_key() -> Optional[str]:
+    """
+    API ключ поточного запиту: HTTP заголовок, ключ MCP сесії або глобальний
+    """
+    task_key = background_api_key.get()
+    if task_key:
+        return task_key
+    header_key = get_http_headers().get(API_KEY_HEADER)
+    if header_key:
+        return header_key
+    session_id = current_session_id()
+    if session_id is not None and current_transport() == "sse":
+        key = session_api_keys.get(session_id)
+        if key is not None:
+            session_api_keys.move_to_end(session_id)
+            return key
+    return api_key
+
+
 # Базовий URL для AUTO.RIA API
-BASE_URL = "https://developers.ria.com/auto"
+BASE_URL = os.getenv("AUTO_RIA_BASE_URL", "https://developers.ria.com/auto")
 
-@mcp.tool()
-def set_api_key(key: str) -> str:
+# ---------- налаштування HTTP клієнта ----------
+HTTP_TIMEOUT = float(os.getenv("AUTO_RIA_TIMEOUT", "30"))
+# Таймаути окремих ендпоінтів (с); решта (довідники) використовує HTTP_TIMEOUT
+ENDPOINT_TIMEOUTS: Dict[str, float] = {
+    "search": float(os.getenv("AUTO_RIA_TIMEOUT_SEARCH", "10")),
+    "info": float(os.getenv("AUTO_RIA_TIMEOUT_INFO", "8")),
+    "average_price": float(os.getenv("AUTO_RIA_TIMEOUT_AVERAGE_PRICE", "10")),
+}
+HTTP_MAX_CONNECTIONS = int(os.getenv("AUTO_RIA_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("AUTO_RIA_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("AUTO_RIA_KEEPALIVE_EXPIRY", "60"))
+HTTP2_ENABLED = os.getenv("AUTO_RIA_HTTP2", "0") == "1"
+# Стиснення відповідей (gzip/deflate; br - якщо встановлений brotli) та умовні запити з ETag/Last-Modified
+HTTP_COMPRESSION = os.getenv("AUTO_RIA_HTTP_COMPRESSION", "1") == "1"
+CONDITIONAL_REQUESTS = os.getenv("AUTO_RIA_CONDITIONAL_REQUESTS", "1") == "1"
+
+# Окремий пул з'єднань для кожного API ключа, спільний для всіх інструментів
+HTTP_MAX_TENANT_CLIENTS = int(os.getenv("AUTO_RIA_MAX_TENANT_CLIENTS", "64"))
+http_clients: "OrderedDict[str, httpx.AsyncClient]" = OrderedDict()
+
+
+def create_http_client() -> "httpx.AsyncClient":
+    """
+    Створює HTTP клієнт з пулом з'єднань, keep-alive та (опціонально) HTTP/2
     """
-    Встановлює API ключ для AUTO.RIA
+    import httpx
 
-    Args:
-        key: API ключ отриманий з developers.ria.com
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401  (потрібен пакет httpx[http2])
+        except ImportError:
+            http2 = False
+
+    return httpx.AsyncClient(
+        headers={"Accept-Encoding": accept_encoding()},
+        timeout=HTTP_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        http2=http2,
+    )
+
+
+def accept_encoding() -> str:
     """
-    global api_key
-    api_key = key
-    return f"API ключ встановлено успішно"
+    Кодування, які клієнт уміє розпакувати; "identity" - якщо стиснення вимкнено
+    """
+    if not HTTP_COMPRESSION:
+        return "identity"
+    encodings = ["gzip", "deflate"]
+    for module in ("brotli", "brotlicffi"):  # httpx розпаковує br будь-яким з них
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        encodings.append("br")
+        break
+    return ", ".join(encodings)
 
 
-def add_list_params(params: dict, param_name: str, values: Optional[List[int]]) -> None:
+def get_http_client(key: Optional[str] = None) -> "httpx.AsyncClient":
     """
-    Додає параметри списку до словника параметрів у правильному форматі для AUTO.RIA API
+    Повертає HTTP клієнт для API ключа, створюючи його при першому використанні
     """
-    if values:
-        # Спробуємо різні формати - спочатку через кому
-        params[param_name] = values
-        # Альтернативно, можна спробувати формат з індексами
-        # for i, value in enumerate(values):
-        #     params[f"{param_name}[{i}]"] = value
+    name = key or ""
+    client = http_clients.get(name)
+    if client is not None and not client.is_closed:
+        http_clients.move_to_end(name)
+        return client
+
+    client = http_clients[name] = create_http_client()
+    while len(http_clients) > HTTP_MAX_TENANT_CLIENTS:
+        _, evicted = http_clients.popitem(last=False)
+        # Закриваємо не одразу: витіснений клієнт може ще виконувати запити
+        asyncio.ensure_future(_close_later(evicted))
+    return client
+
+
+async def _close_later(client: "httpx.AsyncClient") -> None:
+    await asyncio.sleep(HTTP_TIMEOUT)
+    await client.aclose()
 
 
-def add_array_params(params: Dict[str, Any], name: str,
-                     values: Optional[List[int]]) -> None:
+async def close_http_client() -> None:
     """
-    Додає елементи списку до словника параметрів у форматі name[0], name[1]...
+    Закриває всі HTTP клієнти та відкриті з'єднання
     """
-    if values:
-        for idx, val in enumerate(values):
-            params[f"{name}[{idx}]"] = val
+    clients = list(http_clients.values())
+    http_clients.clear()
+    for client in clients:
+        await client.aclose()
 
 
-@mcp.tool()
-async def search_cars(
-    category_id: int = 1,
-    s_yers: Optional[List[int]] = None,
-    po_yers: Optional[List[int]] = None,
-    price_ot: Optional[int] = None,
-    price_do: Optional[int] = None,
-    currency: int = 1,
-    auctionPossible: Optional[int] = None,
-    exchangePossible: Optional[int] = None,
-    with_exchange_type: Optional[int] = None,
-    credit_possible: Optional[int] = None,
-    under_credit: Optional[int] = None,
-    confiscated_car: Optional[int] = None,
-    custom_cleared: Optional[int] = None,
-    page: int = 0,
-    countpage: int = 20,
-    auto_id: Optional[int] = None,
-    marka_id: Optional[List[int]] = None,
-    model_id: Optional[List[int]] = None,
-    city_id: Optional[List[int]] = None,
-    state_id: Optional[List[int]] = None,
-    gear_id: Optional[List[int]] = None,
-    drive_id: Optional[List[int]] = None,
-    fuel_id: Optional[List[int]] = None,
-    engineVolume_ot: Optional[float] = None,
-    engineVolume_do: Optional[float] = None,
-    power_ot: Optional[int] = None,
-    power_do: Optional[int] = None,
-    raceInt_ot: Optional[int] = None,
-    raceInt_do: Optional[int] = None,
-    bodystyle_id: Optional[List[int]] = None,
-    color_id: Optional[List[int]] = None,
-    verified: Optional[int] = None
+# ---------- кеш відповідей ----------
+# TTL (секунди) для кожного endpoint-а AUTO.RIA
+CACHE_TTL: Dict[str, float] = {
+    "search": float(os.getenv("AUTO_RIA_CACHE_TTL_SEARCH", "300")),
+    "info": float(os.getenv("AUTO_RIA_CACHE_TTL_INFO", "600")),
+    "average_price": float(os.getenv("AUTO_RIA_CACHE_TTL_AVERAGE_PRICE", "21600")),
+}
+CACHE_MAX_BYTES = int(os.getenv("AUTO_RIA_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Скільки секунд після TTL запис ще віддається як застарілий (stale-while-revalidate),
+# поки у фоні йде оновлення; 0 - вимкнено
+CACHE_STALE_TTL = float(os.getenv("AUTO_RIA_CACHE_STALE_TTL", "3600"))
+# "memory" - лише в процесі, "sqlite" - додатково спільний файл для кількох процесів
+CACHE_BACKEND = os.getenv("AUTO_RIA_CACHE_BACKEND", "memory")
+CACHE_PATH = os.getenv("AUTO_RIA_CACHE_PATH", "auto_ria_cache.sqlite3")
+
+
+def cache_namespace(key: Optional[str]) -> str:
+    """
+    Простір імен кешу для API ключа (сам ключ у кеш не потрапляє)
+    """
+    return hashlib.sha1(key.encode()).hexdigest()[:12] if key else "-"
+
+
+def make_cache_key(endpoint: str, params: Dict[str, Any]) -> str:
+    """
+    Нормалізований ключ кешу: endpoint + відсортовані параметри без api_key
+    """
+    items = sorted((k, str(v)) for k, v in params.items() if k != "api_key")
+    return f"{endpoint}?{urlencode(items)}"
+
+
+class SQLiteCacheBackend:
+    """
+    Кеш у SQLite файлі, який можуть спільно використовувати кілька процесів сервера
+    """
+
+    def __init__(self, path: str):
+        import sqlite3
+
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, validators TEXT)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(cache)")}
+        if "validators" not in columns:  # файл кешу старішої версії сервера
+            try:
+                self._conn.execute("ALTER TABLE cache ADD COLUMN validators TEXT")
+            except sqlite3.OperationalError:
+                pass  # колонку вже додав інший процес
+
+    def get(self, key: str) -> Optional[Tuple[str, float, Optional[Dict[str, Any]]]]:
+        """
+        Повертає (JSON, залишок TTL у секундах; від'ємний для застарілого запису, валідатори) або None
+        """
+        row = self._conn.execute(
+            "SELECT value, expires_at, validators FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        ttl_left = row[1] - time.time()
+        if ttl_left <= -CACHE_STALE_TTL:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            return None
+        return row[0], ttl_left, json.loads(row[2]) if row[2] else None
+
+    def set(self, key: str, value: str, ttl: float, validators: Optional[Dict[str, Any]] = None) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at, validators) VALUES (?, ?, ?, ?)",
+            (key, value, time.time() + ttl, json.dumps(validators) if validators else None),
+        )
+
+    def touch(self, key: str, ttl: float) -> None:
+        self._conn.execute("UPDATE cache SET expires_at = ? WHERE key = ?", (time.time() + ttl, key))
+
+    def clear(self) -> None:
+        self._conn.execute("DELETE FROM cache")
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class ResponseCache:
+    """
+    In-process TTL + LRU кеш з обмеженням за розміром (байти серіалізованого JSON)
+    """
+
+    def __init__(self, max_bytes: int, backend: Optional[SQLiteCacheBackend] = None):
+        self.max_bytes = max_bytes
+        self.backend = backend
+        # key -> (expires_at, size, value, validators); запис живе ще CACHE_STALE_TTL після expires_at
+        self._entries: "OrderedDict[str, Tuple[float, int, Any, Optional[Dict[str, Any]]]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+        self.backend_hits = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Лише свіже значення або None
+        """
+        value, stale = self.lookup(key)
+        return None if stale else value
+
+    def lookup(self, key: str) -> Tuple[Optional[Any], bool]:
+        """
+        (значення, чи воно застаріле); (None, False), якщо запису немає
+        """
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] + CACHE_STALE_TTL > now:
+                self._entries.move_to_end(key)
+                return self._hit(entry[2], stale=entry[0] < now)
+            self._remove(key)
+
+        loaded = self._load(key)
+        if loaded is not None:
+            return self._hit(loaded[0], stale=loaded[1] <= 0)
+
+        self.misses += 1
+        return None, False
+
+    def _load(self, key: str) -> Optional[Tuple[Any, float]]:
+        """
+        Переносить запис з SQLite у пам'ять; (значення, залишок TTL) або None
+        """
+        if self.backend is None:
+            return None
+        stored = self.backend.get(key)
+        if stored is None:
+            return None
+        raw, ttl_left, validators = stored
+        self.backend_hits += 1
+        value = decode_json(raw)
+        self._store(key, value, len(raw), ttl_left, validators)
+        return value, ttl_left
+
+    def _hit(self, value: Any, stale: bool) -> Tuple[Any, bool]:
+        if stale:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return value, stale
+
+    def set(
+        self,
+        key: str,
+        value: Any,
+        ttl: float,
+        raw: Optional[bytes] = None,
+        validators: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """
+        raw - тіло відповіді, з якого розібрано value: розмір і запис у SQLite
+        беруться з нього, без повторної серіалізації value;
+        validators - ETag/Last-Modified відповіді для умовного запиту (див. response_validators)
+        """
+        if raw is None:
+            raw = json.dumps(value, ensure_ascii=False).encode()
+        self._store(key, value, len(raw), ttl, validators)
+        if self.backend is not None:
+            self.backend.set(key, raw.decode(), ttl, validators)
+
+    def validators(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Валідатори запису (зокрема застарілого), якщо він ще в кеші
+        """
+        entry = self._entries.get(key)
+        if entry is None and self._load(key) is not None:
+            entry = self._entries.get(key)
+        return entry[3] if entry is not None else None
+
+    def refresh(self, key: str, ttl: float) -> Optional[Any]:
+        """
+        Продовжує TTL запису після 304 Not Modified і повертає його значення;
+        None, якщо запис уже витіснено
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries[key] = (time.monotonic() + ttl, *entry[1:])
+        self._entries.move_to_end(key)
+        self.revalidated += 1
+        if self.backend is not None:
+            self.backend.touch(key, ttl)
+        return entry[2]
+
+    def _store(
+        self, key: str, value: Any, size: int, ttl: float, validators: Optional[Dict[str, Any]] = None
+    ) -> None:
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, size, value, validators)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        size = self._entries.pop(key)[1]
+        self._bytes -= size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "stale_ttl": CACHE_STALE_TTL,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "backend": CACHE_BACKEND if self.backend is not None else "memory",
+            "backend_hits": self.backend_hits,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+response_cache = ResponseCache(
+    CACHE_MAX_BYTES,
+    backend=SQLiteCacheBackend(CACHE_PATH) if CACHE_BACKEND == "sqlite" else None,
+)
+
+# Негативний кеш: відповіді 400/404 (неіснуючі або некоректні ID) повторно не запитуються
+# протягом NEGATIVE_CACHE_TTL секунд
+NEGATIVE_CACHE_TTL = float(os.getenv("AUTO_RIA_NEGATIVE_CACHE_TTL", "120"))
+NEGATIVE_CACHE_STATUSES = {400, 404}
+NEGATIVE_CACHE_MAX_ENTRIES = 10000
+
+
+class NegativeCache:
+    """
+    Останні помилки 400/404 за ключем запиту (лише в процесі, обмежена кількість записів)
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Exception]]" = OrderedDict()
+        self.hits = 0
+
+    def get(self, key: str) -> Optional[Exception]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, error: Exception) -> None:
+        if self.ttl <= 0:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, error)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "ttl": self.ttl}
+
+
+negative_cache = NegativeCache(NEGATIVE_CACHE_TTL, NEGATIVE_CACHE_MAX_ENTRIES)
+
+
+# ---------- розбір JSON відповідей ----------
+_json_loads: Optional[Callable[[Any], Any]] = None
+
+
+def decode_json(content: Any) -> Any:
+    """
+    Розбирає JSON з bytes або str: orjson, якщо встановлений (швидше і без проміжного
+    str усього тіла, який створює json.loads(bytes)), інакше стандартний json
+    """
+    global _json_loads
+    if _json_loads is None:
+        try:
+            import orjson
+            _json_loads = orjson.loads
+        except ImportError:
+            _json_loads = json.loads
+    return _json_loads(content)
+
+
+_json_dumps_sorted: Optional[Callable[[Any], bytes]] = None
+
+
+def canonical_json(value: Any) -> bytes:
+    """
+    JSON з відсортованими ключами (для хешу вмісту та збереження): orjson, якщо встановлений
+    """
+    global _json_dumps_sorted
+    if _json_dumps_sorted is None:
+        try:
+            import orjson
+            options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+            _json_dumps_sorted = lambda v: orjson.dumps(v, option=options)
+        except ImportError:
+            _json_dumps_sorted = lambda v: json.dumps(v, sort_keys=True, ensure_ascii=False).encode()
+    return _json_dumps_sorted(value)
+
+
+# ---------- обмеження частоти запитів до API ----------
+RATE_PER_SECOND = float(os.getenv("AUTO_RIA_RATE_PER_SECOND", "5"))
+RATE_BURST = int(os.getenv("AUTO_RIA_RATE_BURST", "10"))
+# Token bucket кожного API ключа: не більше RATE_MAX_BUCKETS (LRU), а повністю поповнений
+# і невикористаний RATE_BUCKET_IDLE_TTL секунд bucket видаляється
+RATE_MAX_BUCKETS = int(os.getenv("AUTO_RIA_MAX_RATE_BUCKETS", "10000"))
+RATE_BUCKET_IDLE_TTL = float(os.getenv("AUTO_RIA_RATE_BUCKET_IDLE_TTL", "600"))
+# Скільки часу виклик може чекати в черзі (і на повтори), перш ніж повернути помилку
+RATE_QUEUE_DEADLINE = float(os.getenv("AUTO_RIA_RATE_QUEUE_DEADLINE", "15"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("AUTO_RIA_RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BACKOFF_BASE = float(os.getenv("AUTO_RIA_RETRY_BACKOFF_BASE", "0.5"))
+RETRY_BACKOFF_MAX = float(os.getenv("AUTO_RIA_RETRY_BACKOFF_MAX", "30"))
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+class RateLimitExceeded(Exception):
+    """
+    Виклик не встиг отримати дозвіл ліміту запитів до свого дедлайну
+    """
+
+
+class TokenBucket:
+    """
+    Token bucket для одного API ключа з резервуванням токенів наперед
+
+    Кожен виклик резервує токен і чекає своєї черги; якщо очікування
+    перевищує дедлайн, виклик одразу отримує RateLimitExceeded.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.last_used = self.updated
+        self.paused_until = 0.0
+        self.waiting = 0
+        self.granted = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.retries = 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds: float) -> None:
+        """
+        Призупиняє видачу токенів (наприклад, після 429 з Retry-After)
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self, now: float, ttl: float) -> bool:
+        """
+        Чи можна видалити bucket без втрати стану: ніхто не чекає, запас поповнений, давно не використовувався
+        """
+        self._refill(now)
+        return (not self.waiting and self.tokens >= self.burst and self.paused_until <= now
+                and now - self.last_used >= ttl)
+
+    async def acquire(self, deadline: float) -> None:
+        now = time.monotonic()
+        self.last_used = now
+        self._refill(now)
+        start = max(now, self.paused_until)
+        wait = start - now + max(0.0, 1 - self.tokens) / self.rate
+        if now + wait > deadline:
+            self.rejected += 1
+            raise RateLimitExceeded(
+                f"Ліміт запитів до AUTO.RIA: очікування {wait:.1f} с перевищує дедлайн"
+            )
+        self.tokens -= 1
+        self.granted += 1
+        if wait > 0:
+            self.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.waiting -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "tokens": round(self.tokens, 2),
+            "paused_for": round(max(0.0, self.paused_until - now), 2),
+            "waiting": self.waiting,
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "throttled_429": self.throttled,
+            "retries": self.retries,
+        }
+
+
+class RateLimiter:
+    """
+    Окремий token bucket для кожного API ключа, спільний для всіх інструментів
+
+    Buckets зберігаються в порядку використання: нові витісняють найдавніші (понад max_buckets),
+    а також ті, що давно не використовувались і вже поповнились (idle_ttl).
+    """
+
+    def __init__(self, rate: float, burst: int, max_buckets: int, idle_ttl: float):
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+        self.idle_ttl = idle_ttl
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.evicted = 0
+
+    def bucket(self, key: Optional[str]) -> TokenBucket:
+        key = key or ""
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+            return bucket
+        self._evict(time.monotonic())
+        bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _evict(self, now: float) -> None:
+        while self._buckets:
+            oldest = next(iter(self._buckets.values()))
+            if len(self._buckets) < self.max_buckets and not oldest.idle(now, self.idle_ttl):
+                break
+            self._buckets.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self, key: Optional[str]) -> Dict[str, Any]:
+        """
+        Стан bucket-а лише для ключа того, хто питає (позначений хешем ключа), і загальні лічильники
+        """
+        own = self._buckets.get(key or "")
+        return {
+            "tenants": len(self._buckets),
+            "max_tenants": self.max_buckets,
+            "idle_ttl": self.idle_ttl,
+            "evicted": self.evicted,
+            "bucket": {"namespace": cache_namespace(key), **own.stats()} if own is not None else None,
+        }
+
+
+rate_limiter = RateLimiter(RATE_PER_SECOND, RATE_BURST, RATE_MAX_BUCKETS, RATE_BUCKET_IDLE_TTL)
+
+
+def parse_retry_after(response: "httpx.Response") -> Optional[float]:
+    """
+    Retry-After у секундах (підтримуються обидва формати: число та HTTP дата)
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    Експоненційна затримка з jitter; Retry-After від сервера має пріоритет
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, RETRY_BACKOFF_BASE)
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+
+# ---------- circuit breaker: швидка відмова, поки API недоступний ----------
+# Скільки поспіль невдалих запитів (5xx, таймаути, мережеві помилки) відкривають breaker
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("AUTO_RIA_BREAKER_THRESHOLD", "5"))
+# Скільки секунд breaker відкритий, перш ніж пропустити пробний запит
+BREAKER_COOLDOWN = float(os.getenv("AUTO_RIA_BREAKER_COOLDOWN", "30"))
+
+
+class CircuitOpenError(Exception):
+    """
+    Запит не виконувався: ендпоінт нещодавно був недоступний
+    """
+
+
+class CircuitBreaker:
+    """
+    Breaker одного ендпоінта: closed -> open (після серії збоїв) -> half-open (один пробний запит)
+    """
+
+    def __init__(self, endpoint: str, threshold: int, cooldown: float):
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_in_flight = False
+        self.rejected = 0
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def check(self) -> None:
+        """
+        Піднімає CircuitOpenError, якщо запит треба відхилити без звернення до API
+        """
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return
+        self.rejected += 1
+        retry_in = max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+        raise CircuitOpenError(
+            f"AUTO.RIA /{self.endpoint} тимчасово недоступний; повторіть через {retry_in:.0f} с"
+        )
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    def release(self) -> None:
+        """
+        Запит завершився без відповіді API (ліміт, скасування): пробу можна повторити
+        """
+        self.probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.failures,
+                "trips": self.trips, "rejected": self.rejected}
+
+
+class CircuitBreakers:
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, endpoint: str) -> CircuitBreaker:
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers[endpoint] = CircuitBreaker(endpoint, self.threshold, self.cooldown)
+        return breaker
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: breaker.stats() for name, breaker in sorted(self._breakers.items())}
+
+
+circuit_breakers = CircuitBreakers(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN)
+
+
+# ---------- інструментація: фази виклику, гістограми латентності, спани ----------
+# Межі кошиків гістограм у мілісекундах
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+# Спани фаз створюються через OpenTelemetry API (його встановлює fastmcp) і стають дочірніми
+# до спана виклику інструмента, який відкриває fastmcp; куди їх експортувати, визначає
+# налаштований TracerProvider (logfire, opentelemetry-instrument тощо)
+TRACING_ENABLED = os.getenv("AUTO_RIA_TRACING", "1") == "1"
+# Події httpcore (trace extension), що починають і завершують фази запиту до API;
+# upstream_wait - від надсилання запиту до отримання заголовків відповіді
+HTTP_PHASE_STARTS = {
+    "connect_tcp": "connect",  # DNS + TCP
+    "start_tls": "tls",
+    "send_request_headers": "upstream_wait",
+    "receive_response_body": "body_read",
+}
+HTTP_PHASE_ENDS = {
+    "connect_tcp": "connect",
+    "start_tls": "tls",
+    "receive_response_headers": "upstream_wait",
+    "receive_response_body": "body_read",
+}
+
+
+class LatencyHistogram:
+    """
+    Гістограма з фіксованими кошиками: запис за O(log n), перцентилі з точністю до межі кошика
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, seconds: float) -> None:
+        ms = seconds * 1000
+        self.buckets[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q: float) -> float:
+        rank = self.count * q / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                bound = HISTOGRAM_BOUNDS_MS[i] if i < len(HISTOGRAM_BOUNDS_MS) else self.max_ms
+                return round(min(bound, self.max_ms), 3)
+        return round(self.max_ms, 3)
+
+    def stats(self) -> Dict[str, Any]:
+        bounds = [f"<={b}" for b in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets_ms": {b: n for b, n in zip(bounds, self.buckets) if n},
+        }
+
+
+class ServerMetrics:
+    """
+    Гістограми латентності (інструменти, фази, ендпоінти API) та лічильники подій
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.counters: Dict[str, int] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def incr(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def stats(self) -> Dict[str, Any]:
+        groups: Dict[str, Dict[str, Any]] = {"tool": {}, "phase": {}, "upstream": {}}
+        for name, histogram in sorted(self.histograms.items()):
+            group, _, label = name.partition(".")
+            groups.setdefault(group, {})[label] = histogram.stats()
+        return {
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "tools": groups["tool"],
+            "phases": groups["phase"],
+            "upstream": groups["upstream"],
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+
+metrics = ServerMetrics()
+
+
+class CallTrace:
+    """
+    Час одного виклику інструмента за фазами; доступний усім корутинам виклику через ContextVar
+    """
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.phases: Dict[str, float] = {}
+        self.body_end: Optional[float] = None
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+current_trace: ContextVar[Optional[CallTrace]] = ContextVar("auto_ria_call_trace", default=None)
+_tracer: Any = None
+
+
+def get_tracer() -> Any:
+    """
+    OpenTelemetry tracer або None, якщо трасування вимкнено
+    """
+    global _tracer
+    if _tracer is None:
+        if TRACING_ENABLED:
+            from opentelemetry import trace
+            _tracer = trace.get_tracer("auto_ria_mcp")
+        else:
+            _tracer = False
+    return _tracer or None
+
+
+def record_phase(phase: str, seconds: float) -> None:
+    metrics.record(f"phase.{phase}", seconds)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(phase, seconds)
+
+
+@contextmanager
+def timed_phase(phase: str, **attributes: Any):
+    """
+    Вимірює фазу виклику: гістограма, розбивка поточного виклику та дочірній спан
+    """
+    tracer = get_tracer()
+    span = tracer.start_as_current_span(f"auto_ria.{phase}", attributes=attributes) if tracer else nullcontext()
+    with span:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            record_phase(phase, time.perf_counter() - started)
+
+
+def http_trace_hook() -> Callable[[str, Dict[str, Any]], Awaitable[None]]:
+    """
+    Callback для httpx extensions={"trace": ...}: розкладає запит на DNS/connect, TLS,
+    очікування відповіді та читання тіла
+    """
+    started: Dict[str, float] = {}
+
+    async def on_event(name: str, info: Dict[str, Any]) -> None:
+        # name: "<connection|http11|http2>.<подія>.<started|complete|failed>"
+        event, _, stage = name.rpartition(".")
+        event = event.partition(".")[2]
+        if stage == "started":
+            phase = HTTP_PHASE_STARTS.get(event)
+            if phase is not None:
+                started[phase] = time.perf_counter()
+        else:
+            phase = HTTP_PHASE_ENDS.get(event)
+            if phase is not None and phase in started:
+                record_phase(phase, time.perf_counter() - started.pop(phase))
+
+    return on_event
+
+
+def instrumented(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Декоратор інструмента (під @mcp.tool()): позначає кінець тіла виклику, решта часу до
+    відповіді - серіалізація fastmcp. Поза MCP (прямий виклик) записує латентність сам
+    """
+    name = fn.__name__
+
+    def finish(trace: Optional[CallTrace], started: float) -> None:
+        if trace is not None and trace.tool == name:
+            trace.body_end = time.perf_counter()
+        elif trace is None:
+            metrics.record(f"tool.{name}", time.perf_counter() - started)
+
+    if asyncio.iscoroutinefunction(fn):
+        @wraps(fn)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                finish(current_trace.get(), started)
+        return async_wrapper
+
+    @wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            finish(current_trace.get(), started)
+    return wrapper
+
+
+class InstrumentationMiddleware(Middleware):
+    """
+    Повний час tools/call (включно з валідацією аргументів і серіалізацією відповіді)
+    """
+
+    async def on_call_tool(self, context: MiddlewareContext, call_next: Callable[..., Awaitable[Any]]) -> Any:
+        name = context.message.name
+        trace = CallTrace(name)
+        token = current_trace.set(trace)
+        loop_monitor.enter(name)
+        started = time.perf_counter()
+        try:
+            return await call_next(context)
+        except Exception:
+            metrics.incr(f"tool_errors.{name}")
+            raise
+        finally:
+            ended = time.perf_counter()
+            if trace.body_end is not None:
+                record_phase("serialize", ended - trace.body_end)
+            metrics.record(f"tool.{name}", ended - started)
+            loop_monitor.leave(name)
+            current_trace.reset(token)
+
+
+# ---------- стан event loop: затримка, повільні callback-и, винесення важкої роботи ----------
+# Усі сесії обслуговує один event loop, тож будь-яка довга синхронна ділянка затримує всі виклики.
+# fastmcp виконує синхронні інструменти в пулі потоків (anyio, 40 потоків): там лишаються важкі
+# (query_listings, market_stats, refine_listings), а тривіальні оголошені async, щоб не чекати
+# звільнення потоку за важкими. Пакети для сховища записуються в потоці: це багато коротких
+# викликів, між якими GIL повертається до loop (один великий виклик C, як розбір JSON, потік не пришвидшить).
+LOOP_LAG_INTERVAL = float(os.getenv("AUTO_RIA_LOOP_LAG_INTERVAL", "0.05"))
+# Затримка (мс), з якої сплеск записується разом з інструментами, що тоді виконувались
+LOOP_LAG_SPIKE_MS = float(os.getenv("AUTO_RIA_LOOP_LAG_SPIKE_MS", "50"))
+# > 0: asyncio debug режим і запис callback-ів, довших за поріг (мс); debug режим сповільнює loop
+SLOW_CALLBACK_MS = float(os.getenv("AUTO_RIA_SLOW_CALLBACK_MS", "0"))
+LOOP_EVENTS_MAX = 50
+# З якої кількості відповідей /info збереження у сховище (JSON, хеш, SQLite) йде в окремому потоці
+OFFLOAD_MIN_ITEMS = 20
+
+
+class LoopMonitor:
+    """
+    Затримка event loop (наскільки пізніше запланованого прокидається таймер), сплески
+    з інструментами, які тоді виконувались, та повільні callback-и з asyncio debug режиму
+    """
+
+    def __init__(self):
+        self.lag = LatencyHistogram()
+        self.spikes: "deque[Dict[str, Any]]" = deque(maxlen=LOOP_EVENTS_MAX)
+        self.slow_callbacks: "deque[Dict[str, Any]]" = deque(maxlen=LOOP_EVENTS_MAX)
+        self.slow_callback_count = 0
+        self.interval = LOOP_LAG_INTERVAL
+        self.active: Dict[str, int] = {}
+        # Інструменти, що почались після попереднього виміру: сплеск видно лише
+        # після того, як блокуюча ділянка завершилась (інструмент міг уже завершитись)
+        self.started_since_tick: set = set()
+
+    def enter(self, tool: str) -> None:
+        self.active[tool] = self.active.get(tool, 0) + 1
+        self.started_since_tick.add(tool)
+
+    def leave(self, tool: str) -> None:
+        if self.active.get(tool, 0) > 1:
+            self.active[tool] -= 1
+        else:
+            self.active.pop(tool, None)
+
+    async def run(self, interval: float) -> None:
+        loop = asyncio.get_running_loop()
+        self.interval = interval
+        if SLOW_CALLBACK_MS > 0:
+            self.trace_slow_callbacks(loop)
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - started - interval)
+            self.lag.record(lag)
+            if lag * 1000 >= LOOP_LAG_SPIKE_MS:
+                self.spikes.append({"at": round(time.time(), 3), "lag_ms": round(lag * 1000, 1),
+                                    "tools": sorted(self.started_since_tick | set(self.active))})
+            self.started_since_tick.clear()
+
+    def trace_slow_callbacks(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Вмикає asyncio debug режим і перехоплює його попередження "Executing <callback> took N seconds"
+        """
+        import logging
+
+        monitor = self
+
+        class SlowCallbackHandler(logging.Handler):
+            def emit(self, record: logging.LogRecord) -> None:
+                if record.msg.startswith("Executing") and len(record.args or ()) == 2:
+                    monitor.slow_callback_count += 1
+                    monitor.slow_callbacks.append({"at": round(record.created, 3),
+                                                   "ms": round(record.args[1] * 1000, 1),
+                                                   "callback": str(record.args[0])[:300]})
+
+        loop.set_debug(True)
+        loop.slow_callback_duration = SLOW_CALLBACK_MS / 1000
+        logging.getLogger("asyncio").addHandler(SlowCallbackHandler(logging.WARNING))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_s": self.interval,
+            "lag": self.lag.stats(),
+            "spikes": list(self.spikes),
+            "slow_callback_ms": SLOW_CALLBACK_MS or None,
+            "slow_callbacks": self.slow_callback_count,
+            "recent_slow_callbacks": list(self.slow_callbacks),
+        }
+
+
+loop_monitor = LoopMonitor()
+
+
+# ---------- об'єднання однакових запитів (single-flight) ----------
+class SingleFlight:
+    """
+    Однакові паралельні запити чекають на один спільний upstream виклик
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, "asyncio.Task[Any]"] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        # shield: скасування одного з викликів не скасовує запит для інших
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: "asyncio.Task[Any]") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # позначаємо виняток як оброблений
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._inflight),
+            "upstream_calls": self.leaders,
+            "coalesced_calls": self.coalesced,
+        }
+
+
+single_flight = SingleFlight()
+
+
+# Виклики, яким потрібні актуальні дані (опитування збережених пошуків, sync_listings):
+# задається на весь виклик, тож діє і на запити зсередини інших інструментів (search_cars_all)
+require_fresh: ContextVar[bool] = ContextVar("auto_ria_require_fresh", default=False)
+
+
+@contextmanager
+def fresh_reads() -> Iterator[None]:
+    token = require_fresh.set(True)
+    try:
+        yield
+    finally:
+        require_fresh.reset(token)
+
+
+async def fetch_upstream(
+    endpoint: str,
+    params: Dict[str, Any],
+    cache_key: Optional[str] = None,
+    project: Optional[Callable[[Any], Any]] = None,
+    fresh: Optional[bool] = None
+) -> Any:
+    """
+    GET запит до AUTO.RIA API через спільний клієнт з кешуванням відповіді
+
+    Args:
+        endpoint: шлях відносно BASE_URL ("search", "info", "average_price")
+        params: параметри запиту (включно з api_key)
+        cache_key: готовий ключ кешу, якщо параметри вже нормалізовані
+                   (до нього додається простір імен API ключа)
+        project: залишає з розібраної відповіді лише потрібні поля; кешується
+                 саме результат (під окремим ключем), решта відповіді одразу звільняється
+        fresh: не віддавати запис кешу без запиту до API (за замовчуванням - require_fresh);
+               запис з ETag/Last-Modified перевіряється умовним GET і при 304 не завантажується
+
+    Застарілий запис кешу віддається одразу, а оновлюється у фоні (stale-while-revalidate);
+    нещодавні 400/404 повторюються з негативного кешу без запиту до API.
+
+    Returns:
+        Розібраний JSON відповіді (або результат project)
+    """
+    return (await fetch_upstream_with_source(endpoint, params, cache_key, project, fresh))[0]
+
+
+async def fetch_upstream_with_source(
+    endpoint: str,
+    params: Dict[str, Any],
+    cache_key: Optional[str] = None,
+    project: Optional[Callable[[Any], Any]] = None,
+    fresh: Optional[bool] = None
+) -> Tuple[Any, bool]:
+    """
+    fetch_upstream, що також повідомляє, чи значення взято з кешу без запиту до API
+    """
+    key = f"{cache_namespace(params.get('api_key'))}:{cache_key or make_cache_key(endpoint, params)}"
+    if project is not None:
+        key = f"{key}|{project.__name__}"
+    if fresh is None:
+        fresh = require_fresh.get()
+    cached, stale = (None, False) if fresh else response_cache.lookup(key)
+    if cached is not None:
+        if stale:
+            metrics.incr("cache_stale_served")
+            revalidate(key, lambda: _request_upstream(endpoint, params, key, project))
+        else:
+            metrics.incr("cache_hits")
+        return cached, True
+
+    error = negative_cache.get(key)
+    if error is not None:
+        metrics.incr("negative_cache_hits")
+        raise error.with_traceback(None)
+
+    return await single_flight.do(key, lambda: _request_upstream(endpoint, params, key, project)), False
+
+
+# Фонові оновлення застарілих записів (посилання, щоб задачі не зібрав GC)
+background_refreshes: "set[asyncio.Task[Any]]" = set()
+
+
+def revalidate(key: str, fn: Callable[[], Awaitable[Any]]) -> None:
+    """
+    Запускає фонове оновлення запису кешу; однакові оновлення об'єднує single-flight
+    """
+    # Порожній контекст: оновлення не належить до виклику інструмента, який його запустив
+    task = asyncio.get_running_loop().create_task(single_flight.do(key, fn), context=contextvars.Context())
+    background_refreshes.add(task)
+    task.add_done_callback(_refresh_done)
+
+
+def _refresh_done(task: "asyncio.Task[Any]") -> None:
+    background_refreshes.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        metrics.incr("background_refresh_errors")
+
+
+async def _request_upstream(
+    endpoint: str,
+    params: Dict[str, Any],
+    key: str,
+    project: Optional[Callable[[Any], Any]] = None
+) -> Any:
+    import httpx
+
+    endpoint_name = endpoint.split("/", 1)[0]
+    breaker = circuit_breakers.get(endpoint_name)
+    breaker.check()
+    # Застарілий запис з ETag/Last-Modified перевіряється умовним GET: незмінена відповідь - 304 без тіла
+    validators = response_cache.validators(key) if CONDITIONAL_REQUESTS else None
+    try:
+        response = await _get_with_retries(endpoint, params, endpoint_name, conditional_headers(validators))
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()  # API відповідає, помилка в самому запиті
+            if e.response.status_code in NEGATIVE_CACHE_STATUSES:
+                negative_cache.set(key, e)
+        raise
+    except httpx.TransportError:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    breaker.record_success()
+
+    ttl = CACHE_TTL.get(endpoint, 60)
+    if response.status_code == 304:
+        cached = response_cache.refresh(key, ttl)
+        if cached is not None:
+            metrics.incr(f"not_modified.{endpoint_name}")
+            metrics.incr(f"bytes_saved_not_modified.{endpoint_name}", validators.get("bytes", 0))
+            return cached
+        # Запис витіснили, поки йшов запит: тепер без валідаторів, тобто звичайний GET
+        return await _request_upstream(endpoint, params, key, project)
+
+    with timed_phase("json_decode", endpoint=endpoint_name, bytes=len(response.content)):
+        data = decode_json(response.content)
+    validators = response_validators(response)
+    if project is not None:
+        data = project(data)
+        response_cache.set(key, data, ttl, validators=validators)
+    else:
+        response_cache.set(key, data, ttl, raw=response.content, validators=validators)
+    return data
+
+
+def response_validators(response: "httpx.Response") -> Optional[Dict[str, Any]]:
+    """
+    ETag/Last-Modified відповіді та її розмір на дроті (скільки заощадить 304); None, якщо валідаторів немає
+    """
+    etag = response.headers.get("etag")
+    last_modified = response.headers.get("last-modified")
+    if etag is None and last_modified is None:
+        return None
+    return {"etag": etag, "last_modified": last_modified, "bytes": response.num_bytes_downloaded}
+
+
+def conditional_headers(validators: Optional[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+    if not validators:
+        return None
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+async def _get_with_retries(
+    endpoint: str,
+    params: Dict[str, Any],
+    endpoint_name: str,
+    headers: Optional[Dict[str, str]] = None
+) -> "httpx.Response":
+    """
+    GET з лімітом запитів ключа та повторами після 429/502/503/504 і мережевих помилок;
+    з умовними заголовками (headers) 304 Not Modified - успішна відповідь
+    """
+    import httpx
+
+    client = get_http_client(params.get("api_key"))
+    bucket = rate_limiter.bucket(params.get("api_key"))
+    deadline = time.monotonic() + RATE_QUEUE_DEADLINE
+    timeout = ENDPOINT_TIMEOUTS.get(endpoint_name, HTTP_TIMEOUT)
+    trace_hook = http_trace_hook()
+    attempt = 0
+    while True:
+        with timed_phase("queue_wait"):
+            await bucket.acquire(deadline)
+        try:
+            started = time.perf_counter()
+            response = await client.get(f"{BASE_URL}/{endpoint}", params=params, headers=headers,
+                                        timeout=timeout, extensions={"trace": trace_hook})
+            metrics.record(f"upstream.{endpoint_name}", time.perf_counter() - started)
+            metrics.incr(f"upstream_status.{response.status_code}")
+            # Тіло на дроті (стиснене) і після розпакування, без заголовків
+            metrics.incr(f"bytes_wire.{endpoint_name}", response.num_bytes_downloaded)
+            metrics.incr(f"bytes_body.{endpoint_name}", len(response.content))
+            if response.status_code == 304 and headers:
+                break
+            response.raise_for_status()
+            break
+        except (httpx.HTTPStatusError, httpx.TransportError) as e:
+            status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            if status is None:
+                metrics.incr(f"upstream_errors.{type(e).__name__}")
+            if status is not None and status not in RETRY_STATUS_CODES:
+                raise
+            retry_after = parse_retry_after(e.response) if status is not None else None
+            if status == 429:
+                bucket.throttled += 1
+                if retry_after is not None:
+                    bucket.pause(retry_after)
+            delay = backoff_delay(attempt, retry_after)
+            if attempt >= RETRY_MAX_ATTEMPTS or time.monotonic() + delay > deadline:
+                raise
+            attempt += 1
+            bucket.retries += 1
+            with timed_phase("retry_backoff"):
+                await asyncio.sleep(delay)
+    return response
+
+
+# ---------- довідники ID (марки, моделі, міста, області, ...) ----------
+REFERENCE_PATH = os.getenv("AUTO_RIA_REFERENCE_PATH", "auto_ria_reference.json")
+# Через скільки секунд знімок довідників вважається застарілим (за замовчуванням 7 днів)
+REFERENCE_MAX_AGE = float(os.getenv("AUTO_RIA_REFERENCE_MAX_AGE", str(7 * 24 * 3600)))
+REFERENCE_CHECK_INTERVAL = 60.0
+# Невідомі ID відхиляються лише за свіжим знімком (молодшим за REFERENCE_STRICT_AGE секунд);
+# за старішим запит іде в API з попередженням: марку чи місто могли додати після знімка
+REFERENCE_STRICT_AGE = float(os.getenv("AUTO_RIA_REFERENCE_STRICT_AGE", "3600"))
+# Ключ оператора сервера для фонового оновлення довідників. Ключі клієнтів для нього не беруться:
+# без ключа оператора довідники оновлює ліниво той клієнт, якому вони потрібні (resolve_ids, search_cars)
+OPERATOR_API_KEY = os.getenv("AUTO_RIA_API_KEY")
+
+# Тип довідника -> endpoint AUTO.RIA (для легкових авто, category_id=1)
+REFERENCE_CATEGORY_ID = 1
+REFERENCE_ENDPOINTS: Dict[str, str] = {
+    "marka": "categories/1/marks",
+    "state": "states",
+    "fuel": "type",
+    "bodystyle": "categories/1/bodystyles",
+    "color": "colors",
+    "gear": "categories/1/gearboxes",
+    "drive": "categories/1/driverTypes",
+}
+# Довідники, свої для кожної категорії: для інших категорій завантажених індексів немає
+REFERENCE_CATEGORY_KINDS = frozenset(
+    kind for kind, endpoint in REFERENCE_ENDPOINTS.items() if endpoint.startswith("categories/")
+)
+# Параметр search_cars -> тип довідника, для перевірки ID до запиту в мережу
+REFERENCE_PARAMS: Dict[str, str] = {
+    "marka_id": "marka",
+    "state_id": "state",
+    "city_id": "city",
+    "fuel_id": "fuel",
+    "bodystyle_id": "bodystyle",
+    "color_id": "color",
+    "gear_id": "gear",
+    "drive_id": "drive",
+}
+
+_NAME_SEPARATORS = re.compile(r"[\s\-_.,/]+")
+
+
+def normalize_name(name: str) -> str:
+    """
+    Нормалізує назву для пошуку: регістр, дефіси та пробіли не важливі ("X 5" == "x5")
+    """
+    return _NAME_SEPARATORS.sub("", name.casefold())
+
+
+class NameIndex:
+    """
+    Довідник одного типу: пошук ID за назвою за O(1), а також префіксний та нечіткий пошук
+    """
+
+    def __init__(self, items: List[Tuple[str, int, Optional[int]]]):
+        # (назва, ID, батьківський ID - наприклад область для міста)
+        self.items = items
+        self._by_norm: Dict[str, int] = {}
+        for pos, (name, _, _) in enumerate(items):
+            self._by_norm.setdefault(normalize_name(name), pos)
+        self._sorted = sorted(self._by_norm)
+        self._ids = frozenset(item[1] for item in items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def has_id(self, item_id: int) -> bool:
+        return item_id in self._ids
+
+    def _describe(self, pos: int) -> Dict[str, Any]:
+        name, item_id, parent_id = self.items[pos]
+        result: Dict[str, Any] = {"id": item_id, "name": name}
+        if parent_id is not None:
+            result["parent_id"] = parent_id
+        return result
+
+    def lookup(self, name: str) -> Optional[Dict[str, Any]]:
+        pos = self._by_norm.get(normalize_name(name))
+        return None if pos is None else self._describe(pos)
+
+    def suggest(self, name: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Кандидати за префіксом, а якщо їх немає - нечіткі збіги
+        """
+        norm = normalize_name(name)
+        start = bisect.bisect_left(self._sorted, norm)
+        names = []
+        for candidate in self._sorted[start:start + limit]:
+            if not candidate.startswith(norm):
+                break
+            names.append(candidate)
+        if not names:
+            import difflib
+
+            names = difflib.get_close_matches(norm, self._sorted, n=limit, cutoff=0.6)
+        return [self._describe(self._by_norm[n]) for n in names]
+
+
+class ReferenceIndex:
+    """
+    Довідники AUTO.RIA в пам'яті: завантажуються зі знімка на диску і оновлюються у фоні
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.updated_at = 0.0
+        # Тип -> [[назва, ID, батьківський ID], ...] у форматі знімка
+        self._raw: Dict[str, List[list]] = {}
+        self._indexes: Dict[str, NameIndex] = {}
+        self._refreshing: Optional["asyncio.Task[None]"] = None
+        self._refresh_started = 0.0
+
+    def _set(self, kind: str, items: List[list]) -> None:
+        self._raw[kind] = items
+        self._indexes[kind] = NameIndex([(name, int(item_id), parent) for name, item_id, parent in items])
+
+    def get(self, kind: str) -> Optional[NameIndex]:
+        return self._indexes.get(kind)
+
+    def load(self) -> bool:
+        """
+        Завантажує знімок довідників з диску (якщо він існує)
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+        for kind, items in snapshot.get("data", {}).items():
+            self._set(kind, items)
+        self.updated_at = float(snapshot.get("updated_at", 0))
+        return True
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"updated_at": self.updated_at, "data": self._raw}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def age(self) -> float:
+        return time.time() - self.updated_at
+
+    def is_stale(self) -> bool:
+        return self.age() > REFERENCE_MAX_AGE
+
+    @staticmethod
+    def _parse(items: Any, parent_id: Optional[int] = None) -> List[list]:
+        return [[item["name"], int(item["value"]), parent_id]
+                for item in items or [] if "name" in item and "value" in item]
+
+    async def refresh(self, key: str) -> None:
+        """
+        Завантажує всі довідники (крім моделей) з API та зберігає знімок
+        """
+        kinds = list(REFERENCE_ENDPOINTS)
+        results = await asyncio.gather(
+            *(fetch_upstream(REFERENCE_ENDPOINTS[kind], {"api_key": key}) for kind in kinds)
+        )
+        for kind, items in zip(kinds, results):
+            self._set(kind, self._parse(items))
+
+        states = [item[1] for item in self._raw.get("state", [])]
+        cities = await asyncio.gather(
+            *(fetch_upstream(f"states/{state_id}/cities", {"api_key": key}) for state_id in states)
+        )
+        self._set("city", [row for state_id, items in zip(states, cities)
+                           for row in self._parse(items, state_id)])
+
+        self.updated_at = time.time()
+        self.save()
+
+    def refresh_in_background(self, key: str) -> None:
+        """
+        Запускає оновлення у фоні, якщо воно ще не виконується і не запускалось останні
+        REFERENCE_CHECK_INTERVAL секунд (невдале оновлення не повторюється на кожен запит)
+        """
+        now = time.monotonic()
+        if (self._refreshing is None or self._refreshing.done()) and now - self._refresh_started >= REFERENCE_CHECK_INTERVAL:
+            self._refresh_started = now
+            self._refreshing = asyncio.ensure_future(self.refresh(key))
+            self._refreshing.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def ensure_models(self, key: str, marka_id: int) -> NameIndex:
+        """
+        Моделі завантажуються ліниво для кожної марки і додаються до знімка
+        """
+        kind = f"model:{marka_id}"
+        index = self._indexes.get(kind)
+        if index is None:
+            items = await fetch_upstream(f"categories/1/marks/{marka_id}/models", {"api_key": key})
+            self._set(kind, self._parse(items, marka_id))
+            self.save()
+            index = self._indexes[kind]
+        return index
+
+    def unknown_ids(
+        self,
+        filters: Dict[str, Optional[List[int]]],
+        category_id: Optional[int] = REFERENCE_CATEGORY_ID
+    ) -> Dict[str, List[int]]:
+        """
+        Перевіряє ID параметрів пошуку за завантаженими довідниками (без запитів у мережу);
+        для category_id, відмінної від легкових авто, довідники категорії не перевіряються
+        """
+        unknown: Dict[str, List[int]] = {}
+        for param, values in filters.items():
+            kind = REFERENCE_PARAMS.get(param, "")
+            if category_id not in (None, REFERENCE_CATEGORY_ID) and kind in REFERENCE_CATEGORY_KINDS:
+                continue
+            index = self._indexes.get(kind)
+            if not values or not index:
+                continue
+            missing = [v for v in values if not index.has_id(v)]
+            if missing:
+                unknown[param] = missing
+        return unknown
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "updated_at": self.updated_at,
+            "stale": self.is_stale(),
+            "sizes": {kind: len(index) for kind, index in self._indexes.items()},
+        }
+
+
+reference_index = ReferenceIndex(REFERENCE_PATH)
+
+
+async def reference_refresher() -> None:
+    """
+    Фонове оновлення застарілого знімка довідників ключем оператора (AUTO_RIA_API_KEY)
+    """
+    if not OPERATOR_API_KEY:
+        return
+    while True:
+        if reference_index.is_stale():
+            try:
+                await reference_index.refresh(OPERATOR_API_KEY)
+            except Exception:
+                pass  # спробуємо знову на наступній ітерації
+        await asyncio.sleep(REFERENCE_CHECK_INTERVAL)
+
+
+# ---------- локальне сховище оголошень ----------
+# Порожній шлях вимикає сховище
+STORE_PATH = os.getenv("AUTO_RIA_STORE_PATH", "auto_ria_listings.sqlite3")
+
+# Колонки сховища, за якими можна фільтрувати та сортувати локально
+STORE_COLUMNS = ("price_usd", "year", "mileage", "city", "title", "marka_id", "model_id", "state_id")
+
+
+class ListingStore:
+    """
+    SQLite сховище оголошень за auto_id: результати пошуку та відповіді /info з хешем вмісту
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional["sqlite3.Connection"] = None
+        # Лічильник змін колонок у цьому процесі; разом з PRAGMA data_version (зміни інших
+        # процесів) визначає, чи актуальна закешована ListingTable
+        self.version = 0
+        self._table: Optional[Tuple[Tuple[int, int], "ListingTable"]] = None
+
+    @property
+    def conn(self) -> "sqlite3.Connection":
+        if self._conn is None:
+            import sqlite3
+
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS listings ("
+                "auto_id INTEGER PRIMARY KEY, info TEXT, content_hash TEXT, "
+                "price_usd INTEGER, year INTEGER, mileage INTEGER, city TEXT, title TEXT, "
+                "marka_id INTEGER, model_id INTEGER, state_id INTEGER, "
+                "first_seen REAL NOT NULL, last_seen REAL NOT NULL, fetched_at REAL, changed_at REAL)"
+            )
+            for column in ("price_usd", "year", "mileage", "marka_id", "last_seen"):
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_listings_{column} ON listings ({column})"
+                )
+        return self._conn
+
+    def mark_seen(self, auto_ids: List[int]) -> None:
+        """
+        Фіксує ID з результатів пошуку (нові записи створюються без /info)
+        """
+        now = time.time()
+        self.conn.executemany(
+            "INSERT INTO listings (auto_id, first_seen, last_seen) VALUES (?, ?, ?) "
+            "ON CONFLICT(auto_id) DO UPDATE SET last_seen = excluded.last_seen",
+            [(auto_id, now, now) for auto_id in auto_ids],
+        )
+
+    def upsert_infos(self, infos: Dict[int, Any]) -> Dict[str, int]:
+        """
+        Зберігає відповіді /info; повертає кількість нових, змінених та незмінних записів
+        """
+        now = time.time()
+        known = self.hashes(list(infos))
+        counts = {"new": 0, "changed": 0, "unchanged": 0}
+        rows = []
+        for auto_id, info in infos.items():
+            # Одна серіалізація і для хешу, і для збереження
+            raw = canonical_json(info)
+            digest = hashlib.sha1(raw).hexdigest()
+            previous = known.get(auto_id)
+            if previous is None:
+                counts["new"] += 1
+            elif previous != digest:
+                counts["changed"] += 1
+            else:
+                counts["unchanged"] += 1
+            auto = info.get("autoData") or {}
+            state = info.get("stateData") or {}
+            rows.append((
+                auto_id, raw.decode(), digest,
+                info.get("USD"), auto.get("year"), auto.get("raceInt"),
+                info.get("locationCityName") or state.get("name"), info.get("title"),
+                info.get("markId"), info.get("modelId"), state.get("stateId"),
+                now, now, now, now if previous != digest else None,
+            ))
+        self.conn.executemany(
+            "INSERT INTO listings (auto_id, info, content_hash, price_usd, year, mileage, city, title, "
+            "marka_id, model_id, state_id, first_seen, last_seen, fetched_at, changed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(auto_id) DO UPDATE SET info = excluded.info, content_hash = excluded.content_hash, "
+            "price_usd = excluded.price_usd, year = excluded.year, mileage = excluded.mileage, "
+            "city = excluded.city, title = excluded.title, marka_id = excluded.marka_id, "
+            "model_id = excluded.model_id, state_id = excluded.state_id, last_seen = excluded.last_seen, "
+            "fetched_at = excluded.fetched_at, changed_at = COALESCE(excluded.changed_at, changed_at)",
+            rows,
+        )
+        # Незмінні записи оновлюють лише часові мітки, яких немає в ListingTable
+        if counts["new"] or counts["changed"]:
+            self.version += 1
+        return counts
+
+    def hashes(self, auto_ids: List[int]) -> Dict[int, str]:
+        result: Dict[int, str] = {}
+        # SQLite обмежує кількість параметрів у запиті, тому читаємо частинами
+        for start in range(0, len(auto_ids), 500):
+            chunk = auto_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            result.update(self.conn.execute(
+                f"SELECT auto_id, content_hash FROM listings "
+                f"WHERE auto_id IN ({placeholders}) AND content_hash IS NOT NULL", chunk
+            ).fetchall())
+        return result
+
+    def needs_info(self, auto_ids: List[int], refresh_after: float) -> List[int]:
+        """
+        ID без /info або з /info, старшою за refresh_after секунд
+        """
+        threshold = time.time() - refresh_after
+        fresh: set = set()
+        for start in range(0, len(auto_ids), 500):
+            chunk = auto_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            fresh.update(row[0] for row in self.conn.execute(
+                f"SELECT auto_id FROM listings WHERE auto_id IN ({placeholders}) AND fetched_at >= ?",
+                (*chunk, threshold)
+            ))
+        return [auto_id for auto_id in auto_ids if auto_id not in fresh]
+
+    @staticmethod
+    def _where(where: List[Tuple[str, str, Any]]) -> Tuple[str, List[Any]]:
+        clauses = ["info IS NOT NULL"]
+        values: List[Any] = []
+        for column, op, value in where:
+            clauses.append(f"{column} {op} ?")
+            values.append(value)
+        return " AND ".join(clauses), values
+
+    def load_columns(
+        self,
+        columns: Tuple[str, ...],
+        where: List[Tuple[str, str, Any]],
+        auto_ids: Optional[List[int]] = None
+    ) -> List[tuple]:
+        """
+        Рядки (auto_id, *columns) для аналітики; auto_ids обмежує вибірку конкретними оголошеннями
+        """
+        sql_where, values = self._where(where)
+        sql = f"SELECT auto_id, {', '.join(columns)} FROM listings WHERE {sql_where}"
+        if auto_ids is None:
+            return self.conn.execute(sql, values).fetchall()
+        rows: List[tuple] = []
+        for start in range(0, len(auto_ids), 500):
+            chunk = auto_ids[start:start + 500]
+            rows.extend(self.conn.execute(
+                f"{sql} AND auto_id IN ({','.join('?' * len(chunk))})", (*values, *chunk)
+            ).fetchall())
+        return rows
+
+    def query(
+        self,
+        where: List[Tuple[str, str, Any]],
+        sort_by: str,
+        descending: bool,
+        limit: int,
+        offset: int = 0
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Локальний запит: where - список (колонка, оператор, значення); повертає (кількість, рядки)
+        """
+        sql_where, values = self._where(where)
+        total = self.conn.execute(f"SELECT COUNT(*) FROM listings WHERE {sql_where}", values).fetchone()[0]
+        order = "DESC" if descending else "ASC"
+        rows = self.conn.execute(
+            f"SELECT auto_id, {', '.join(STORE_COLUMNS)} FROM listings WHERE {sql_where} "
+            f"ORDER BY {sort_by} IS NULL, {sort_by} {order} LIMIT ? OFFSET ?",
+            (*values, limit, offset)
+        ).fetchall()
+        return total, [dict(zip(("id",) + STORE_COLUMNS, row)) for row in rows]
+
+    def table(self) -> "ListingTable":
+        """
+        Усі оголошення з /info як масиви колонок; перебудовується лише після змін у сховищі
+        """
+        version = (self.version, self.conn.execute("PRAGMA data_version").fetchone()[0])
+        if self._table is None or self._table[0] != version:
+            self._table = (version, ListingTable(self.load_columns(STORE_COLUMNS, [])))
+        return self._table[1]
+
+    def stats(self) -> Dict[str, Any]:
+        total, with_info = self.conn.execute(
+            "SELECT COUNT(*), COUNT(info) FROM listings"
+        ).fetchone()
+        return {"path": self.path, "listings": total, "with_info": with_info}
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._table = None
+
+
+listing_store: Optional[ListingStore] = ListingStore(STORE_PATH) if STORE_PATH else None
+
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """
+    Життєвий цикл сервера: HTTP клієнти створюються при першому запиті (без імпорту
+    httpx до першої відповіді tools/list) і закриваються при зупинці
+    """
+    reference_index.load()
+    refresher = asyncio.ensure_future(reference_refresher())
+    watcher = asyncio.ensure_future(watch_scheduler.run())
+    monitor = asyncio.ensure_future(loop_monitor.run(LOOP_LAG_INTERVAL))
+    try:
+        yield {}
+    finally:
+        refresher.cancel()
+        watcher.cancel()
+        monitor.cancel()
+        await close_http_client()
+        if listing_store is not None:
+            listing_store.close()
+        if response_cache.backend is not None:
+            response_cache.backend.close()
+
+
+mcp = FastMCP("AUTO.RIA Search Server 🚗", lifespan=lifespan)
+mcp.add_middleware(InstrumentationMiddleware())
+
+@mcp.tool()
+@instrumented
+async def set_api_key(key: str) -> Dict[str, Any]:
+    """
+    Встановлює API ключ для AUTO.RIA: для SSE сесії - лише для неї, для stdio - для процесу;
+    по Streamable HTTP ключ передається в заголовку X-Auto-Ria-Api-Key кожного запиту
+
+    Args:
+        key: API ключ отриманий з developers.ria.com
+    """
+    global api_key
+    transport = current_transport()
+    if transport == "streamable-http":
+        # ID сесії генерується для кожного запиту (і кожного воркера), ключ загубився б одразу
+        return {
+            "success": False,
+            "error": "По Streamable HTTP ключ не зберігається між запитами. "
+                     f"Передавайте його в HTTP заголовку {API_KEY_HEADER} кожного запиту"
+        }
+    session_id = current_session_id()
+    # stdio та in-memory транспорт: процес обслуговує рівно одного клієнта, а ID сесії
+    # може генеруватись заново для кожного запиту, тож ключ зберігається глобально
+    if session_id is None or transport != "sse":
+        api_key = key
+    else:
+        session_api_keys[session_id] = key
+        session_api_keys.move_to_end(session_id)
+        while len(session_api_keys) > SESSION_KEYS_MAX:
+            session_api_keys.popitem(last=False)
+    return {"success": True, "message": "API ключ встановлено успішно"}
+
+
+# ---------- кодування параметрів пошуку ----------
+# Схема параметрів /search: (назва, списковий параметр, значення, яке не передається в API).
+# Параметри зі значенням None не передаються ніколи.
+SEARCH_PARAMS_SCHEMA: Tuple[Tuple[str, bool, Any], ...] = (
+    ("category_id", False, None),
+    ("page", False, None),
+    ("countpage", False, None),
+    ("price_ot", False, None),
+    ("price_do", False, None),
+    ("currency", False, 1),
+    ("auctionPossible", False, None),
+    ("exchangePossible", False, None),
+    ("with_exchange_type", False, None),
+    ("credit_possible", False, None),
+    ("under_credit", False, None),
+    ("confiscated_car", False, None),
+    ("custom_cleared", False, None),
+    ("auto_id", False, None),
+    ("engineVolume_ot", False, None),
+    ("engineVolume_do", False, None),
+    ("power_ot", False, None),
+    ("power_do", False, None),
+    ("raceInt_ot", False, None),
+    ("raceInt_do", False, None),
+    ("verified", False, None),
+    ("s_yers", True, None),
+    ("po_yers", True, None),
+    ("marka_id", True, None),
+    ("model_id", True, None),
+    ("city_id", True, None),
+    ("state_id", True, None),
+    ("gear_id", True, None),
+    ("drive_id", True, None),
+    ("fuel_id", True, None),
+    ("bodystyle_id", True, None),
+    ("color_id", True, None),
+)
+SEARCH_MAX_COUNTPAGE = 100
+SEARCH_ARRAY_KEYS_PRECOMPILED = 32
+
+# Канонічний запит: відсортований кортеж пар (ключ, значення) без api_key
+SearchQuery = Tuple[Tuple[str, str], ...]
+
+
+class SearchQueryEncoder:
+    """
+    Табличний кодувальник параметрів /search
+
+    Схема перевіряється і "компілюється" один раз: ключі виду name[0], name[1], ...
+    для спискових параметрів створюються заздалегідь, тому на кожен виклик
+    лишається один прохід по таблиці та сортування пар.
+    """
+
+    def __init__(self, schema: Tuple[Tuple[str, bool, Any], ...]):
+        names = [name for name, _, _ in schema]
+        if len(names) != len(set(names)):
+            raise ValueError("Дублікати в схемі параметрів пошуку")
+        self.names = frozenset(names)
+        self.array_names = frozenset(name for name, is_array, _ in schema if is_array)
+        self._scalars = tuple((name, omit) for name, is_array, omit in schema if not is_array)
+        self._arrays = tuple(
+            (name, tuple(f"{name}[{idx}]" for idx in range(SEARCH_ARRAY_KEYS_PRECOMPILED)))
+            for name, is_array, _ in schema if is_array
+        )
+
+    def encode(self, values: Dict[str, Any]) -> SearchQuery:
+        pairs: List[Tuple[str, str]] = []
+        append = pairs.append
+        for name, omit in self._scalars:
+            value = values.get(name)
+            if value is not None and value != omit:
+                append((name, str(value)))
+        for name, keys in self._arrays:
+            items = values.get(name)
+            if items:
+                if len(items) > len(keys):
+                    keys = keys + tuple(f"{name}[{idx}]" for idx in range(len(keys), len(items)))
+                pairs.extend(zip(keys, map(str, items)))
+        pairs.sort()
+        return tuple(pairs)
+
+
+SEARCH_QUERY_ENCODER = SearchQueryEncoder(SEARCH_PARAMS_SCHEMA)
+# Параметри, якими керують інструменти з пагінацією, а не фільтри пошуку
+SEARCH_PAGING_PARAMS = ("page", "countpage", "view")
+
+
+def normalize_search_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Фільтри для search_cars(**filters) зі словника клієнта: без параметрів пагінації,
+    одиничне значення спискового параметра загортається в список; ValueError для невідомих ключів
+    """
+    filters = {k: v for k, v in (filters or {}).items() if k not in SEARCH_PAGING_PARAMS}
+    unknown = sorted(k for k in filters if k not in SEARCH_QUERY_ENCODER.names)
+    if unknown:
+        allowed = sorted(SEARCH_QUERY_ENCODER.names.difference(SEARCH_PAGING_PARAMS))
+        raise ValueError(f"Невідомі параметри пошуку: {', '.join(unknown)} (допустимі: {', '.join(allowed)})")
+    for name in SEARCH_QUERY_ENCODER.array_names.intersection(filters):
+        value = filters[name]
+        if value is not None and not isinstance(value, list):
+            filters[name] = list(value) if isinstance(value, tuple) else [value]
+    return filters
+
+
+def search_cache_key(query: SearchQuery) -> str:
+    """
+    Ключ кешу для канонічного запиту (збігається з make_cache_key для тих самих параметрів)
+    """
+    return f"search?{urlencode(query)}"
+
+
+def search_ids_only(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Проєкція відповіді /search для компактних викликів: лише ID та кількість у тій самій
+    структурі (search_result_common, additional_params тощо не тримаються в кеші)
+    """
+    result = data.get("result")
+    if not isinstance(result, dict):
+        return data
+    search_result = result.get("search_result") or {}
+    return {
+        "result": {"search_result": {"ids": search_result.get("ids", []),
+                                     "count": search_result.get("count", 0)}},
+        "count": data.get("count", 0),
+    }
+
+
+# ---------- компактне представлення оголошень ----------
+# Поля компактної схеми та функції, що дістають їх з відповіді /info
+COMPACT_FIELDS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "id": lambda info: (info.get("autoData") or {}).get("autoId", info.get("auto_id")),
+    "price_usd": lambda info: info.get("USD"),
+    "year": lambda info: (info.get("autoData") or {}).get("year"),
+    "mileage": lambda info: (info.get("autoData") or {}).get("raceInt"),
+    "city": lambda info: info.get("locationCityName") or (info.get("stateData") or {}).get("name"),
+    "title": lambda info: info.get("title"),
+}
+VIEWS = ("full", "compact", "columnar")
+SEARCH_VIEWS = ("full", "compact")
+
+
+def resolve_fields(view: str, fields: Optional[List[str]]) -> List[str]:
+    """
+    Перевіряє view/fields і повертає список полів проєкції (порожній для view="full")
+    """
+    if view not in VIEWS:
+        raise ValueError(f"Невідомий view: {view} (допустимі: {', '.join(VIEWS)})")
+    if fields:
+        unknown = [f for f in fields if f not in COMPACT_FIELDS]
+        if unknown:
+            raise ValueError(f"Невідомі поля: {', '.join(unknown)} (допустимі: {', '.join(COMPACT_FIELDS)})")
+        return list(fields)
+    return [] if view == "full" else list(COMPACT_FIELDS)
+
+
+def project_listing(info: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """
+    Проєкція відповіді /info на компактну схему
+    """
+    return {name: COMPACT_FIELDS[name](info) for name in fields}
+
+
+def to_columnar(listings: List[Dict[str, Any]], fields: List[str]) -> Dict[str, Any]:
+    """
+    Колонкове представлення: паралельні масиви замість списку словників
+    """
+    return {
+        "fields": fields,
+        "rows": len(listings),
+        "columns": {name: [COMPACT_FIELDS[name](info) for info in listings] for name in fields},
+    }
+
+
+@mcp.tool()
+@instrumented
+async def search_cars(
+    *,
+    category_id: int = 1,
+    s_yers: Optional[List[int]] = None,
+    po_yers: Optional[List[int]] = None,
+    price_ot: Optional[int] = None,
+    price_do: Optional[int] = None,
+    currency: int = 1,
+    auctionPossible: Optional[int] = None,
+    exchangePossible: Optional[int] = None,
+    with_exchange_type: Optional[int] = None,
+    credit_possible: Optional[int] = None,
+    under_credit: Optional[int] = None,
+    confiscated_car: Optional[int] = None,
+    custom_cleared: Optional[int] = None,
+    page: int = 0,
+    countpage: int = 20,
+    auto_id: Optional[int] = None,
+    marka_id: Optional[List[int]] = None,
+    model_id: Optional[List[int]] = None,
+    city_id: Optional[List[int]] = None,
+    state_id: Optional[List[int]] = None,
+    gear_id: Optional[List[int]] = None,
+    drive_id: Optional[List[int]] = None,
+    fuel_id: Optional[List[int]] = None,
+    engineVolume_ot: Optional[float] = None,
+    engineVolume_do: Optional[float] = None,
+    power_ot: Optional[int] = None,
+    power_do: Optional[int] = None,
+    raceInt_ot: Optional[int] = None,
+    raceInt_do: Optional[int] = None,
+    bodystyle_id: Optional[List[int]] = None,
+    color_id: Optional[List[int]] = None,
+    verified: Optional[int] = None,
+    view: str = "full"
+) -> Dict[str, Any]:
+    """
+    Пошук автомобільних оголошень через AUTO.RIA API
+
+    Args:
+        category_id: ID категорії (1 - легкові авто, 2 - мото, 3 - вантажівки, 4 - автобуси, 5 - причепи, 6 - с/г техніка, 7 - спецтехніка, 8 - водний транспорт, 9 - повітряний транспорт)
+        s_yers: Рік випуску від (список років)
+        po_yers: Рік випуску до (список років)
+        price_ot: Ціна від
+        price_do: Ціна до
+        currency: Валюта (1 - USD, 2 - EUR, 3 - UAH)
+        auctionPossible: Можливість аукціону (0 - ні, 1 - так)
+        exchangePossible: Можливість обміну (0 - ні, 1 - так)
+        with_exchange_type: Тип обміну (1 - авто, 2 - нерухомість, 3 - комерція)
+        credit_possible: Можливість кредиту (0 - ні, 1 - так)
+        under_credit: Під кредитом (0 - ні, 1 - так)
+        confiscated_car: Конфісковане авто (0 - ні, 1 - так)
+        custom_cleared: Розмитнене (0 - ні, 1 - так)
+        page: Номер сторінки (початок з 0)
+        countpage: Кількість записів на сторінку (макс 100)
+        auto_id: ID конкретного авто
+        marka_id: ID марки авто (список)
+        model_id: ID моделі авто (список)
+        city_id: ID міста (список)
+        state_id: ID області (список)
+        gear_id: ID коробки передач (список: 1 - ручна, 2 - автомат, 3 - типтронік, 4 - адаптивна, 5 - варіатор)
+        drive_id: ID приводу (список: 1 - передній, 2 - задній, 3 - повний)
+        fuel_id: ID типу палива (список)
+        engineVolume_ot: Об'єм двигуна від (л)
+        engineVolume_do: Об'єм двигуна до (л)
+        power_ot: Потужність від (к.с.)
+        power_do: Потужність до (к.с.)
+        raceInt_ot: Пробіг від (тис. км)
+        raceInt_do: Пробіг до (тис. км)
+        bodystyle_id: ID типу кузова (список)
+        color_id: ID кольору (список)
+        verified: Перевірені оголошення (0 - ні, 1 - так)
+        view: "full" - сира відповідь API, "compact" - лише список ID оголошень ("ids");
+              інші значення - помилка
+
+    Returns:
+        Словник з результатами пошуку
+    """
+    import httpx
+
+    key = get_api_key()
+
+    # ---------- нормалізація та валідація аргументів ----------
+    countpage = min(countpage, SEARCH_MAX_COUNTPAGE)  # API ліміт
+    if not key:
+        return {"success": False,
+                "error": "API ключ не встановлено; спершу викличте set_api_key()"}
+    if view not in SEARCH_VIEWS:
+        return {"success": False,
+                "error": f"Невідомий view: {view} (допустимі: {', '.join(SEARCH_VIEWS)})"}
+    if s_yers and po_yers and len(s_yers) != len(po_yers):
+        return {"success": False,
+                "error": "s_yers і po_yers повинні бути однакової довжини"}
+    unknown = reference_index.unknown_ids({
+        "marka_id": marka_id, "state_id": state_id, "city_id": city_id,
+        "fuel_id": fuel_id, "bodystyle_id": bodystyle_id, "color_id": color_id,
+        "gear_id": gear_id, "drive_id": drive_id
+    }, category_id=category_id)
+    reference_warning = None
+    if unknown:
+        if reference_index.age() <= REFERENCE_STRICT_AGE:
+            return {"success": False,
+                    "error": f"Невідомі ID у довідниках: {unknown}. Скористайтесь resolve_ids()"}
+        reference_warning = (f"ID {unknown} немає в знімку довідників віком {reference_index.age() / 3600:.0f} год; "
+                             f"запит передано в API без перевірки, довідники оновлюються")
+        reference_index.refresh_in_background(key)
+
+    # ---------- параметри запиту ----------
+    with timed_phase("param_build"):
+        # Значення параметрів схеми SEARCH_PARAMS_SCHEMA для табличного кодувальника
+        query_values = {
+            "category_id": category_id, "page": page, "countpage": countpage,
+            "price_ot": price_ot, "price_do": price_do, "currency": currency,
+            "auctionPossible": auctionPossible, "exchangePossible": exchangePossible,
+            "with_exchange_type": with_exchange_type, "credit_possible": credit_possible,
+            "under_credit": under_credit, "confiscated_car": confiscated_car, "custom_cleared": custom_cleared,
+            "auto_id": auto_id, "engineVolume_ot": engineVolume_ot, "engineVolume_do": engineVolume_do,
+            "power_ot": power_ot, "power_do": power_do, "raceInt_ot": raceInt_ot, "raceInt_do": raceInt_do,
+            "verified": verified, "s_yers": s_yers, "po_yers": po_yers, "marka_id": marka_id,
+            "model_id": model_id, "city_id": city_id, "state_id": state_id, "gear_id": gear_id,
+            "drive_id": drive_id, "fuel_id": fuel_id, "bodystyle_id": bodystyle_id, "color_id": color_id,
+        }
+        query = SEARCH_QUERY_ENCODER.encode(query_values)
+        params: Dict[str, Any] = {"api_key": key, **dict(query)}
+
+    # ---------- HTTP запит ----------
+    try:
+        data, from_cache = await fetch_upstream_with_source(
+            "search", params, cache_key=search_cache_key(query),
+            project=None if view == "full" else search_ids_only
+        )
+        # Відповідь з кешу вже зафіксована в сховищі тим запитом, що її завантажив
+        if listing_store is not None and not from_cache:
+            await store_seen(extract_search_ids({"cars": data.get("result")}))
+
+        if view != "full":
+            result = {
+                "success": True,
+                "total_count": extract_total_count({"cars": data.get("result")}) or data.get("count", 0),
+                "ids": extract_search_ids({"cars": data.get("result")}),
+                "page": page,
+                "countpage": countpage
+            }
+        else:
+            result = {
+                "success": True,
+                "total_count": data.get("count", 0),
+                "cars": data.get("result", []),
+                "page": page,
+                "countpage": countpage,
+                "request_url": str(httpx.URL(f"{BASE_URL}/search", params=params))  # корисно для дебагу
+            }
+        if reference_warning:
+            result["warning"] = reference_warning
+        return result
+
+    except httpx.HTTPStatusError as e:
+        return {
+            "success": False,
+            "error": f"HTTP {e.response.status_code}: {e.response.text}"
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Неочікувана помилка: {e}"
+        }
+
+
+def extract_search_ids(result: Dict[str, Any]) -> List[int]:
+    """
+    Дістає список ID оголошень з результату search_cars
+    """
+    if "ids" in result:
+        return list(result["ids"])
+    cars = result.get("cars")
+    if isinstance(cars, dict):
+        ids = cars.get("search_result", {}).get("ids", [])
+    elif isinstance(cars, list):
+        ids = cars
+    else:
+        ids = []
+    return [int(i) for i in ids]
+
+
+def extract_total_count(result: Dict[str, Any]) -> int:
+    """
+    Загальна кількість знайдених оголошень з результату search_cars
+    """
+    total = result.get("total_count") or 0
+    cars = result.get("cars")
+    if not total and isinstance(cars, dict):
+        total = cars.get("search_result", {}).get("count", 0)
+    return int(total)
+
+
+SEARCH_ALL_MAX_RESULTS = 5000
+
+
+async def iter_search_pages(
+    filters: Dict[str, Any],
+    countpage: int = 100,
+    max_results: Optional[int] = None,
+    prefetch: int = 3
+) -> AsyncIterator[Tuple[int, List[int], int]]:
+    """
+    Асинхронний генератор сторінок пошуку: (номер сторінки, ID, загальна кількість)
+
+    Наступні сторінки завантажуються паралельно (до prefetch наперед), але
+    віддаються по порядку. Якщо споживач перериває ітерацію, незавершені
+    запити скасовуються.
+    """
+    countpage = max(1, min(countpage, SEARCH_MAX_COUNTPAGE))
+    first = await search_cars(**filters, page=0, countpage=countpage, view="compact")
+    if not first.get("success"):
+        raise RuntimeError(first.get("error", "Помилка пошуку"))
+
+    total = extract_total_count(first)
+    limit = total if max_results is None else min(total, max_results)
+    last_page = max(0, (limit - 1) // countpage)
+    yield 0, extract_search_ids(first), total
+
+    pending: "deque[Tuple[int, asyncio.Task[Dict[str, Any]]]]" = deque()
+    next_page = 1
+    try:
+        while next_page <= last_page or pending:
+            while len(pending) < max(1, prefetch) and next_page <= last_page:
+                task = asyncio.ensure_future(search_cars(**filters, page=next_page, countpage=countpage, view="compact"))
+                pending.append((next_page, task))
+                next_page += 1
+
+            page, task = pending.popleft()
+            result = await task
+            if not result.get("success"):
+                raise RuntimeError(result.get("error", "Помилка пошуку"))
+            ids = extract_search_ids(result)
+            if not ids:
+                break
+            yield page, ids, total
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+
+@mcp.tool()
+@instrumented
+async def search_cars_all(
+    filters: Optional[Dict[str, Any]] = None,
+    max_results: int = 500,
+    countpage: int = 100,
+    prefetch: int = 3,
+    stop_at_id: Optional[int] = None,
+    ctx: Optional[Context] = None
+) -> Dict[str, Any]:
+    """
+    Пошук з автоматичною пагінацією: збирає ID оголошень з усіх сторінок
+
+    Args:
+        filters: Параметри пошуку як у search_cars (marka_id, city_id, s_yers, ...), без page/countpage
+        max_results: Максимальна кількість ID у відповіді (макс 5000)
+        countpage: Розмір сторінки (макс 100)
+        prefetch: Скільки сторінок завантажувати паралельно наперед
+        stop_at_id: Зупинитись, щойно зустрінеться це ID (наприклад, найновіше з попереднього запуску)
+
+    Returns:
+        Словник зі списком ID та загальною кількістю знайдених оголошень
+    """
+    try:
+        filters = normalize_search_filters(filters)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    max_results = max(1, min(max_results, SEARCH_ALL_MAX_RESULTS))
+
+    ids: List[int] = []
+    total = 0
+    pages = 0
+    stopped_by = "exhausted"
+    try:
+        async with aclosing(iter_search_pages(filters, countpage, max_results, prefetch)) as page_iter:
+            async for _, page_ids, total in page_iter:
+                pages += 1
+                if stop_at_id is not None and stop_at_id in page_ids:
+                    ids.extend(page_ids[:page_ids.index(stop_at_id)])
+                    stopped_by = "stop_at_id"
+                    break
+                ids.extend(page_ids)
+                if ctx is not None:
+                    await ctx.report_progress(progress=min(len(ids), max_results),
+                                              total=min(total, max_results))
+                if len(ids) >= max_results:
+                    stopped_by = "max_results"
+                    break
+    except Exception as e:
+        return {"success": False, "error": str(e), "ids": ids, "pages_fetched": pages}
+
+    return {
+        "success": True,
+        "total_count": total,
+        "ids": ids[:max_results],
+        "pages_fetched": pages,
+        "stopped_by": stopped_by
+    }
+
+
+SEARCH_MANY_MAX_QUERIES = 20
+SEARCH_MANY_MAX_RESULTS = 1000
+
+
+@mcp.tool()
+@instrumented
+async def search_cars_many(
+    searches: List[Dict[str, Any]],
+    max_results: int = 200,
+    per_query: int = 100,
+    max_concurrency: int = 4,
+    ctx: Optional[Context] = None
+) -> Dict[str, Any]:
+    """
+    Кілька пошуків одним викликом ("BMW або Audi, Київ або Львів"): виконує їх паралельно
+    і повертає об'єднаний список ID без дублікатів
+
+    Args:
+        searches: Список параметрів пошуку як у search_cars (макс 20), без page/countpage,
+                  напр. [{"marka_id": [9], "city_id": [10]}, {"marka_id": [6], "city_id": [5]}]
+        max_results: Максимальна кількість ID в об'єднаному результаті (макс 1000)
+        per_query: Скільки ID брати з кожного пошуку (з усіх його сторінок)
+        max_concurrency: Скільки пошуків виконувати одночасно
+
+    Returns:
+        Об'єднані ID (по черзі з кожного пошуку) та підсумок по кожному пошуку
+    """
+    if not searches:
+        return {"success": False, "error": "Порожній список пошуків"}
+    if len(searches) > SEARCH_MANY_MAX_QUERIES:
+        return {"success": False,
+                "error": f"Забагато пошуків: {len(searches)} (макс {SEARCH_MANY_MAX_QUERIES})"}
+    max_results = max(1, min(max_results, SEARCH_MANY_MAX_RESULTS))
+    per_query = max(1, min(per_query, SEARCH_ALL_MAX_RESULTS))
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    done = 0
+
+    async def run_one(filters: Dict[str, Any]) -> Dict[str, Any]:
+        nonlocal done
+        async with semaphore:
+            result = await search_cars_all(filters, max_results=per_query)
+        done += 1
+        if ctx is not None:
+            await ctx.report_progress(progress=done, total=len(searches))
+        return result
+
+    results = await asyncio.gather(*(run_one(filters or {}) for filters in searches))
+
+    # По черзі з кожного пошуку, щоб обмежений результат містив усі запити, а не лише перші
+    ids: List[int] = []
+    seen: set = set()
+    contributed = [0] * len(results)
+    queues = [deque(result.get("ids", [])) for result in results]
+    while len(ids) < max_results and any(queues):
+        for index, queue in enumerate(queues):
+            while queue:
+                auto_id = queue.popleft()
+                if auto_id not in seen:
+                    seen.add(auto_id)
+                    ids.append(auto_id)
+                    contributed[index] += 1
+                    break
+            if len(ids) >= max_results:
+                break
+
+    queries = []
+    for index, result in enumerate(results):
+        summary = {"index": index, "total_count": result.get("total_count", 0),
+                   "fetched": len(result.get("ids", [])), "unique_in_result": contributed[index]}
+        if not result.get("success"):
+            summary["error"] = result.get("error")
+        queries.append(summary)
+
+    fetched = [auto_id for result in results for auto_id in result.get("ids", [])]
+    unique = len(set(fetched))
+    return {
+        "success": any(result.get("success") for result in results),
+        "ids": ids,
+        "count": len(ids),
+        "unique_found": unique,
+        "duplicates": len(fetched) - unique,
+        "truncated": unique > len(ids),
+        "queries": queries
+    }
+
+
+@mcp.tool()
+@instrumented
+async def get_car_info(
+    auto_id: int,
+    view: str = "full",
+    fields: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Отримує детальну інформацію про конкретне авто за його ID
+
+    Args:
+        auto_id: ID автомобіля з AUTO.RIA
+        view: "full" - повна відповідь API, "compact" - лише id, price_usd, year, mileage, city, title
+        fields: Підмножина полів компактної схеми (вмикає компактний режим)
+
+    Returns:
+        Словник з детальною інформацією про авто
+    """
+    import httpx
+
+    key = get_api_key()
+    if not key:
+        return {"error": "API ключ не встановлено. Використайте set_api_key() спочатку"}
+
+    try:
+        projection = resolve_fields(view, fields)
+        car_info, cached = await fetch_upstream_with_source("info", {"api_key": key, "auto_id": auto_id})
+        # Значення з кешу вже збережене, коли його вперше отримали з API
+        if listing_store is not None and not cached:
+            listing_store.upsert_infos({auto_id: car_info})
+
+        return {
+            "success": True,
+            "car_info": project_listing(car_info, projection) if projection else car_info
+        }
+
+    except httpx.HTTPError as e:
+        return {
+            "success": False,
+            "error": f"HTTP помилка: {str(e)}"
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Загальна помилка: {str(e)}"
+        }
+
+def format_upstream_error(e: Exception) -> str:
+    """
+    Короткий опис помилки upstream запиту для результатів пакетних інструментів
+    """
+    import httpx
+
+    if isinstance(e, httpx.HTTPStatusError):
+        return f"HTTP {e.response.status_code}"
+    if isinstance(e, (RateLimitExceeded, CircuitOpenError)):
+        return str(e)
+    if isinstance(e, httpx.HTTPError):
+        return f"HTTP помилка: {e}"
+    return f"Неочікувана помилка: {e}"
+
+
+BATCH_MAX_CONCURRENCY = int(os.getenv("AUTO_RIA_BATCH_CONCURRENCY", "10"))
+BATCH_MAX_IDS = 200
+
+
+async def fetch_car_infos(
+    key: str,
+    auto_ids: List[int],
+    max_concurrency: int = BATCH_MAX_CONCURRENCY
+) -> Tuple[Dict[int, Any], Dict[int, str]]:
+    """
+    Паралельно завантажує /info для списку ID; повертає (відповіді, помилки) за ID
+    """
+    semaphore = asyncio.Semaphore(max(1, min(max_concurrency, HTTP_MAX_CONNECTIONS)))
+
+    async def fetch_one(auto_id: int) -> Any:
+        async with semaphore:
+            return await fetch_upstream("info", {"api_key": key, "auto_id": auto_id})
+
+    results = await asyncio.gather(*(fetch_one(i) for i in auto_ids), return_exceptions=True)
+
+    infos: Dict[int, Any] = {}
+    errors: Dict[int, str] = {}
+    for auto_id, result in zip(auto_ids, results):
+        if isinstance(result, Exception):
+            errors[auto_id] = format_upstream_error(result)
+        else:
+            infos[auto_id] = result
+    return infos, errors
+
+
+@mcp.tool()
+@instrumented
+async def get_cars_info(
+    auto_ids: List[int],
+    max_concurrency: int = BATCH_MAX_CONCURRENCY,
+    view: str = "full",
+    fields: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Отримує детальну інформацію про кілька авто одним викликом (паралельно)
+
+    Args:
+        auto_ids: Список ID автомобілів з AUTO.RIA (макс 200)
+        max_concurrency: Максимальна кількість одночасних запитів до API
+        view: "full" - повні відповіді API, "compact" - компактна схема для кожного авто,
+              "columnar" - компактна схема у вигляді паралельних масивів
+        fields: Підмножина полів компактної схеми (id, price_usd, year, mileage, city, title)
+
+    Returns:
+        Словник з інформацією по кожному ID та окремим словником помилок
+    """
+    key = get_api_key()
+    if not key:
+        return {"success": False,
+                "error": "API ключ не встановлено; спершу викличте set_api_key()"}
+    try:
+        projection = resolve_fields(view, fields)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+
+    unique_ids = list(dict.fromkeys(auto_ids))
+    if len(unique_ids) > BATCH_MAX_IDS:
+        return {"success": False,
+                "error": f"Забагато ID: {len(unique_ids)} (макс {BATCH_MAX_IDS})"}
+
+    infos, failed = await fetch_car_infos(key, unique_ids, max_concurrency)
+    if listing_store is not None and infos:
+        await store_infos(infos)
+    cars: Dict[str, Any] = {str(auto_id): info for auto_id, info in infos.items()}
+    errors: Dict[str, str] = {str(auto_id): error for auto_id, error in failed.items()}
+
+    if view == "columnar":
+        return {
+            "success": bool(cars) or not unique_ids,
+            "requested": len(unique_ids),
+            "cars": to_columnar(list(cars.values()), projection),
+            "errors": errors
+        }
+    if projection:
+        cars = {auto_id: project_listing(info, projection) for auto_id, info in cars.items()}
+
+    return {
+        "success": bool(cars) or not unique_ids,
+        "requested": len(unique_ids),
+        "cars": cars,
+        "errors": errors
+    }
+
+
+def listing_conditions(
+    price_min: Optional[int] = None,
+    price_max: Optional[int] = None,
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+    mileage_min: Optional[int] = None,
+    mileage_max: Optional[int] = None,
+    marka_id: Optional[int] = None,
+    model_id: Optional[int] = None,
+    state_id: Optional[int] = None,
+    city: Optional[str] = None
+) -> List[Tuple[str, str, Any]]:
+    """
+    Умови WHERE для локального сховища з параметрів інструментів
+    """
+    conditions = [
+        ("price_usd", ">=", price_min), ("price_usd", "<=", price_max),
+        ("year", ">=", year_min), ("year", "<=", year_max),
+        ("mileage", ">=", mileage_min), ("mileage", "<=", mileage_max),
+        ("marka_id", "=", marka_id), ("model_id", "=", model_id),
+        ("state_id", "=", state_id), ("city", "=", city),
+    ]
+    return [c for c in conditions if c[2] is not None]
+
+
+STORE_DISABLED_ERROR = "Локальне сховище вимкнено (AUTO_RIA_STORE_PATH порожній)"
+
+
+async def store_infos(infos: Dict[int, Any]) -> Dict[str, int]:
+    """
+    listing_store.upsert_infos; великі пакети - в окремому потоці (SQLite з'єднання серіалізоване)
+    """
+    if len(infos) >= OFFLOAD_MIN_ITEMS:
+        metrics.incr("offloaded.store_infos")
+        return await asyncio.to_thread(listing_store.upsert_infos, infos)
+    return listing_store.upsert_infos(infos)
+
+
+async def store_seen(auto_ids: List[int]) -> None:
+    """
+    listing_store.mark_seen в окремому потоці: запис SQLite не блокує event loop
+    """
+    if auto_ids:
+        await asyncio.to_thread(listing_store.mark_seen, auto_ids)
+
+
+@mcp.tool()
+@instrumented
+async def sync_listings(
+    filters: Optional[Dict[str, Any]] = None,
+    max_results: int = 500,
+    refresh_after: float = 86400,
+    max_concurrency: int = BATCH_MAX_CONCURRENCY,
+    ctx: Optional[Context] = None
+) -> Dict[str, Any]:
+    """
+    Синхронізує оголошення за фільтрами з локальним сховищем
+
+    Проходить усі сторінки пошуку, а /info завантажує лише для нових ID
+    та тих, чия збережена інформація старша за refresh_after секунд.
+
+    Args:
+        filters: Параметри пошуку як у search_cars
+        max_results: Максимальна кількість оголошень для синхронізації (макс 5000)
+        refresh_after: Через скільки секунд збережена /info вважається застарілою
+        max_concurrency: Максимальна кількість одночасних запитів /info
+
+    Returns:
+        Статистика синхронізації: знайдено, нових, змінених, незмінних, помилок
+    """
+    if listing_store is None:
+        return {"success": False, "error": STORE_DISABLED_ERROR}
+    key = get_api_key()
+    if not key:
+        return {"success": False,
+                "error": "API ключ не встановлено; спершу викличте set_api_key()"}
+
+    # Сховище саме вирішує, що застаріло (refresh_after), тож кеш відповідей не підміняє свіжі дані
+    with fresh_reads():
+        found = await search_cars_all(filters, max_results=max_results, ctx=ctx)
+    if not found.get("success"):
+        return found
+
+    ids = found["ids"]
+    to_fetch = listing_store.needs_info(ids, refresh_after)
+    counts = {"new": 0, "changed": 0, "unchanged": 0}
+    errors: Dict[str, str] = {}
+    for start in range(0, len(to_fetch), BATCH_MAX_IDS):
+        with fresh_reads():
+            infos, failed = await fetch_car_infos(key, to_fetch[start:start + BATCH_MAX_IDS], max_concurrency)
+        errors.update({str(auto_id): error for auto_id, error in failed.items()})
+        if infos:
+            for name, value in (await store_infos(infos)).items():
+                counts[name] += value
+        if ctx is not None:
+            await ctx.report_progress(progress=start + len(infos) + len(failed), total=len(to_fetch))
+
+    return {
+        "success": True,
+        "total_count": found["total_count"],
+        "seen": len(ids),
+        "fetched": len(to_fetch) - len(errors),
+        "skipped_fresh": len(ids) - len(to_fetch),
+        **counts,
+        "errors": errors
+    }
+
+
+@mcp.tool()
+@instrumented
+def query_listings(
+    price_min: Optional[int] = None,
+    price_max: Optional[int] = None,
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+    mileage_min: Optional[int] = None,
+    mileage_max: Optional[int] = None,
+    marka_id: Optional[int] = None,
+    model_id: Optional[int] = None,
+    state_id: Optional[int] = None,
+    city: Optional[str] = None,
+    sort_by: str = "price_usd",
+    descending: bool = False,
+    limit: int = 50,
+    offset: int = 0,
+    count_only: bool = False
+) -> Dict[str, Any]:
+    """
+    Запит до локального сховища оголошень (без запитів до AUTO.RIA)
+
+    Args:
+        price_min/price_max: Ціна в USD від/до
+        year_min/year_max: Рік випуску від/до
+        mileage_min/mileage_max: Пробіг від/до (тис. км)
+        marka_id: ID марки
+        model_id: ID моделі
+        state_id: ID області
+        city: Назва міста
+        sort_by: Поле сортування (price_usd, year, mileage, city, title)
+        descending: Сортування за спаданням
+        limit: Кількість записів (макс 500)
+        offset: Зсув для пагінації
+        count_only: Повернути лише кількість
+
+    Returns:
+        Кількість знайдених оголошень та компактні записи
+    """
+    if listing_store is None:
+        return {"success": False, "error": STORE_DISABLED_ERROR}
+    if sort_by not in STORE_COLUMNS:
+        return {"success": False,
+                "error": f"Невідоме поле сортування: {sort_by} (допустимі: {', '.join(STORE_COLUMNS)})"}
+
+    where = listing_conditions(price_min, price_max, year_min, year_max, mileage_min, mileage_max,
+                               marka_id, model_id, state_id, city)
+    total, rows = listing_store.query(
+        where, sort_by, descending, 0 if count_only else max(0, min(limit, 500)), max(0, offset)
+    )
+    if count_only:
+        return {"success": True, "count": total}
+    return {"success": True, "count": total, "listings": rows}
+
+
+# ---------- спостереження за збереженими пошуками ----------
+# Інтервал опитування за замовчуванням (с); фактичний інтервал випадково відхиляється
+# на WATCH_JITTER, щоб опитування не йшли пачками і рівномірно ділили ліміт запитів
+WATCH_DEFAULT_INTERVAL = float(os.getenv("AUTO_RIA_WATCH_INTERVAL", "900"))
+WATCH_MIN_INTERVAL = 60.0
+WATCH_JITTER = 0.1
+WATCH_MAX_WATCHES = int(os.getenv("AUTO_RIA_MAX_WATCHES", "1000"))
+WATCH_MAX_RESULTS = 1000
+# Скільки вже відомих оголошень за одне опитування перевіряти на зміну ціни (/info);
+# перевіряються ті, що перевірялись найдавніше
+WATCH_RECHECK_PER_POLL = int(os.getenv("AUTO_RIA_WATCH_RECHECK", "20"))
+WATCH_CONCURRENCY = 4
+WATCH_INFO_CONCURRENCY = 4
+WATCH_CHECK_INTERVAL = 5.0
+# Черга подій кожного спостереження обмежена окремо: клієнт, що не забирає події,
+# витісняє лише власні старі події
+WATCH_EVENTS_PER_WATCH = 1000
+
+
+class WatchedSearch:
+    """
+    Збережений пошук: фільтри, розклад і знімок {auto_id: [ціна USD або None, час перевірки ціни]}
+    """
+
+    def __init__(
+        self,
+        watch_id: str,
+        key: str,
+        filters: Dict[str, Any],
+        interval: float,
+        max_results: int,
+        session: Any = None
+    ):
+        self.watch_id = watch_id
+        self.key = key
+        self.filters = filters
+        self.interval = interval
+        self.max_results = max_results
+        # MCP сесія, яка створила спостереження: їй надсилаються сповіщення про зміни
+        self.session = session
+        self.snapshot: Dict[int, List[Any]] = {}
+        self.total_count = 0
+        # Фоновий цикл не чіпає спостереження, доки watch_search не завершить початкове опитування
+        self.next_run = float("inf")
+        self.last_run: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.polls = 0
+        self.events = 0
+        self.queue: "deque[Dict[str, Any]]" = deque(maxlen=WATCH_EVENTS_PER_WATCH)
+
+    def schedule(self) -> None:
+        self.next_run = time.monotonic() + self.interval * random.uniform(1 - WATCH_JITTER, 1 + WATCH_JITTER)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "watch_id": self.watch_id,
+            "filters": self.filters,
+            "interval": self.interval,
+            "max_results": self.max_results,
+            "tracked": len(self.snapshot),
+            "total_count": self.total_count,
+            "polls": self.polls,
+            "events": self.events,
+            "last_run": self.last_run,
+            "next_run_in": round(max(0.0, self.next_run - time.monotonic()), 1) if self.polls else None,
+            "last_error": self.last_error,
+        }
+
+
+class WatchScheduler:
+    """
+    Планувальник збережених пошуків: опитує їх за розкладом, порівнює з попереднім знімком
+    за auto_id та ціною і складає зміни в чергу подій
+
+    Опитування - це сторінки /search лише з ID (single-flight об'єднує однакові одночасні пошуки),
+    /info для нових ID та обмеженої кількості відомих для перевірки ціни. Усі запити
+    проходять через ліміт запитів ключа, який створив спостереження.
+    """
+
+    def __init__(self, max_watches: int):
+        self.max_watches = max_watches
+        self.watches: Dict[str, WatchedSearch] = {}
+        self._seq = 0
+        self._next_id = 0
+        self.polls = 0
+        self.poll_errors = 0
+        self.poll_latency = LatencyHistogram()
+
+    def add(self, key: str, filters: Dict[str, Any], interval: float, max_results: int,
+            session: Any = None) -> WatchedSearch:
+        if len(self.watches) >= self.max_watches:
+            raise ValueError(f"Забагато спостережень (макс {self.max_watches})")
+        self._next_id += 1
+        watch = WatchedSearch(f"w{self._next_id}", key, filters, interval, max_results, session)
+        self.watches[watch.watch_id] = watch
+        return watch
+
+    def remove(self, key: str, watch_id: str) -> bool:
+        watch = self.watches.get(watch_id)
+        if watch is None or watch.key != key:
+            return False
+        del self.watches[watch_id]
+        return True
+
+    def for_key(self, key: str) -> List[WatchedSearch]:
+        return [watch for watch in self.watches.values() if watch.key == key]
+
+    def read_events(self, key: str, since: int, watch_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        """
+        Події ключа з номером більше since (від найстаріших); черги спостережень
+        упорядковані за номером, тож зливаються без сортування
+        """
+        watches = [watch for watch in self.for_key(key) if watch_id is None or watch.watch_id == watch_id]
+        events = heapq.merge(*(watch.queue for watch in watches), key=lambda event: event["seq"])
+        return list(itertools.islice((event for event in events if event["seq"] > since), limit))
+
+    def emit(self, watch: WatchedSearch, event: Dict[str, Any]) -> Dict[str, Any]:
+        self._seq += 1
+        event = {"seq": self._seq, "watch_id": watch.watch_id, "ts": time.time(), **event}
+        watch.queue.append(event)
+        watch.events += 1
+        return event
+
+    async def poll(self, watch: WatchedSearch) -> List[Dict[str, Any]]:
+        """
+        Одне опитування: пошук ID, /info для нових та частини відомих, події змін
+        """
+        started = time.perf_counter()
+        self.polls += 1
+        token = background_api_key.set(watch.key)
+        try:
+            with fresh_reads():
+                found = await search_cars_all(watch.filters, max_results=watch.max_results)
+        finally:
+            background_api_key.reset(token)
+        if not found.get("success"):
+            self.poll_errors += 1
+            watch.last_error = found.get("error")
+            return []
+
+        now = time.time()
+        ids = found["ids"]
+        baseline = watch.polls == 0
+        watch.polls += 1
+        watch.last_run = now
+        watch.last_error = None
+        watch.total_count = found["total_count"]
+        snapshot = watch.snapshot
+        current = set(ids)
+
+        # Перше опитування лише запам'ятовує ID; ціни заповнюються поступово перевірками
+        new_ids = [] if baseline else [i for i in ids if i not in snapshot]
+        if baseline:
+            snapshot.update((i, [None, 0.0]) for i in ids)
+        removed = [i for i in snapshot if i not in current]
+        known = sorted((i for i in ids if i in snapshot), key=lambda i: snapshot[i][1])
+        recheck = known[:WATCH_RECHECK_PER_POLL]
+
+        infos: Dict[int, Any] = {}
+        if new_ids or recheck:
+            with fresh_reads():
+                infos, _ = await fetch_car_infos(watch.key, new_ids + recheck, WATCH_INFO_CONCURRENCY)
+            if listing_store is not None and infos:
+                await store_infos(infos)
+
+        events = []
+        for auto_id in new_ids:
+            info = infos.get(auto_id) or {}
+            snapshot[auto_id] = [info.get("USD"), now if auto_id in infos else 0.0]
+            events.append(self.emit(watch, {"type": "new_listing", "auto_id": auto_id,
+                                            "price_usd": info.get("USD"), "title": info.get("title")}))
+        for auto_id in recheck:
+            info = infos.get(auto_id)
+            if info is None:
+                continue
+            entry = snapshot[auto_id]
+            price = info.get("USD")
+            if entry[0] is not None and price is not None and price != entry[0]:
+                events.append(self.emit(watch, {
+                    "type": "price_drop" if price < entry[0] else "price_increase",
+                    "auto_id": auto_id, "old_price_usd": entry[0], "price_usd": price,
+                    "title": info.get("title"),
+                }))
+            entry[0], entry[1] = price, now
+        # Якщо пошук знайшов більше, ніж max_results, знімок - лише вікно результатів,
+        # і зникнення ID з нього не означає, що оголошення зняте
+        complete = watch.total_count <= watch.max_results
+        for auto_id in removed:
+            price = snapshot.pop(auto_id)[0]
+            if complete:
+                events.append(self.emit(watch, {"type": "removed", "auto_id": auto_id, "price_usd": price}))
+
+        self.poll_latency.record(time.perf_counter() - started)
+        if events and watch.session is not None:
+            await self.notify(watch, events)
+        return events
+
+    @staticmethod
+    async def notify(watch: WatchedSearch, events: List[Dict[str, Any]]) -> None:
+        """
+        Надсилає події сесії, яка створила спостереження (MCP notifications/message)
+        """
+        try:
+            for event in events:
+                await watch.session.send_log_message(level="info", data=event, logger="auto_ria.watch")
+        except Exception:
+            watch.session = None  # сесія закрита; події лишаються в черзі get_watch_events
+
+    async def _run_one(self, watch: WatchedSearch, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            # Власний trace: інструменти, викликані опитуванням, не записуються як виклики клієнтів
+            token = current_trace.set(CallTrace("watch_poll"))
+            try:
+                await self.poll(watch)
+            except Exception as e:
+                self.poll_errors += 1
+                watch.last_error = str(e)
+            finally:
+                current_trace.reset(token)
+                watch.schedule()
+
+    async def run(self) -> None:
+        """
+        Фоновий цикл: опитує спостереження, чий час настав, не більше WATCH_CONCURRENCY одночасно
+        """
+        semaphore = asyncio.Semaphore(WATCH_CONCURRENCY)
+        while True:
+            now = time.monotonic()
+            due = [watch for watch in self.watches.values() if watch.next_run <= now]
+            if due:
+                await asyncio.gather(*(self._run_one(watch, semaphore) for watch in due))
+                continue
+            next_run = min((watch.next_run for watch in self.watches.values()), default=now + WATCH_CHECK_INTERVAL)
+            await asyncio.sleep(min(max(next_run - now, 0.0), WATCH_CHECK_INTERVAL))
+
+    def stats(self, key: Optional[str]) -> Dict[str, Any]:
+        """
+        Загальні лічильники планувальника; черга подій - лише спостережень ключа key
+        """
+        return {
+            "watches": len(self.watches),
+            "tracked_listings": sum(len(watch.snapshot) for watch in self.watches.values()),
+            "polls": self.polls,
+            "poll_errors": self.poll_errors,
+            "poll_latency": self.poll_latency.stats(),
+            "queued_events": sum(len(watch.queue) for watch in self.for_key(key or "")),
+        }
+
+
+watch_scheduler = WatchScheduler(WATCH_MAX_WATCHES)
+
+
+@mcp.tool()
+@instrumented
+async def watch_search(
+    filters: Dict[str, Any],
+    interval: float = WATCH_DEFAULT_INTERVAL,
+    max_results: int = 200,
+    ctx: Optional[Context] = None
+) -> Dict[str, Any]:
+    """
+    Зберігає пошук і опитує його на сервері за розкладом: нові оголошення, зміни цін, зняті оголошення
+
+    Події можна забирати через get_watch_events; сесія, що створила спостереження,
+    також отримує їх як MCP сповіщення (notifications/message, logger "auto_ria.watch").
+
+    Args:
+        filters: Параметри пошуку як у search_cars (marka_id, city_id, s_yers, ...), без page/countpage
+        interval: Інтервал опитування в секундах (мін 60)
+        max_results: Скільки оголошень відстежувати (макс 1000)
+
+    Returns:
+        ID спостереження та кількість оголошень у початковому знімку
+    """
+    key = get_api_key()
+    if not key:
+        return {"success": False,
+                "error": "API ключ не встановлено; спершу викличте set_api_key()"}
+    try:
+        filters = normalize_search_filters(filters)
+        watch = watch_scheduler.add(
+            key, filters, max(WATCH_MIN_INTERVAL, interval), max(1, min(max_results, WATCH_MAX_RESULTS)),
+            session=ctx.session if ctx is not None else None,
+        )
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+
+    try:
+        await watch_scheduler.poll(watch)
+    except Exception as e:
+        watch.last_error = str(e)
+    if watch.polls == 0:
+        watch_scheduler.remove(key, watch.watch_id)
+        return {"success": False, "error": watch.last_error}
+    watch.schedule()
+    return {"success": True, **watch.info()}
+
+
+@mcp.tool()
+@instrumented
+async def unwatch_search(watch_id: str) -> Dict[str, Any]:
+    """
+    Видаляє збережений пошук
+
+    Args:
+        watch_id: ID спостереження з watch_search
+    """
+    if not watch_scheduler.remove(get_api_key() or "", watch_id):
+        return {"success": False, "error": f"Спостереження {watch_id} не знайдено"}
+    return {"success": True, "watch_id": watch_id}
+
+
+@mcp.tool()
+@instrumented
+async def list_watches() -> Dict[str, Any]:
+    """
+    Повертає збережені пошуки поточного API ключа та стан їх опитування
+    """
+    return {"success": True, "watches": [watch.info() for watch in watch_scheduler.for_key(get_api_key() or "")]}
+
+
+@mcp.tool()
+@instrumented
+async def get_watch_events(since: int = 0, watch_id: Optional[str] = None, limit: int = 100) -> Dict[str, Any]:
+    """
+    Повертає події збережених пошуків: new_listing, price_drop, price_increase, removed
+
+    Args:
+        since: Номер останньої отриманої події (next_since з попередньої відповіді)
+        watch_id: Лише події одного спостереження
+        limit: Максимальна кількість подій (макс 1000)
+
+    Returns:
+        Події від найстаріших та next_since для наступного виклику
+    """
+    events = watch_scheduler.read_events(get_api_key() or "", since, watch_id, max(1, min(limit, 1000)))
+    return {
+        "success": True,
+        "events": events,
+        "next_since": events[-1]["seq"] if events else max(since, 0),
+    }
+
+
+# ---------- аналітика ринку ----------
+MARKET_PERCENTILES = (5, 25, 50, 75, 95)
+MARKET_MAX_OUTLIERS = 50
+
+
+def _group_stats(keys, prices) -> List[Dict[str, Any]]:
+    """
+    Кількість, середнє та медіана ціни для кожної групи одним проходом (без циклу по рядках)
+    """
+    import numpy as np
+
+    groups, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    sums = np.bincount(inverse, weights=prices)
+    # Медіана групи: сортуємо за (група, ціна) і беремо середні елементи кожного блоку
+    ordered = prices[np.lexsort((prices, inverse))]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    medians = (ordered[starts + (counts - 1) // 2] + ordered[starts + counts // 2]) / 2
+    return [
+        {"key": int(k), "count": int(c), "mean": round(float(m), 2), "median": float(med)}
+        for k, c, m, med in zip(groups, counts, sums / counts, medians)
+    ]
+
+
+def compute_market_stats(ids, prices, years, mileages, regions) -> Dict[str, Any]:
+    """
+    Розподіл цін, регресія ціна/пробіг, розбивка за роками та областями і викиди (NumPy)
+
+    Усі аргументи - одновимірні масиви однакової довжини; пропущені значення - NaN.
+    """
+    import numpy as np
+
+    valid = ~np.isnan(prices)
+    ids, prices, years, mileages, regions = (a[valid] for a in (ids, prices, years, mileages, regions))
+    if prices.size == 0:
+        return {"count": 0}
+
+    q = np.percentile(prices, MARKET_PERCENTILES)
+    q1, q3 = np.percentile(prices, (25, 75))
+    iqr = q3 - q1
+    outlier_mask = (prices < q1 - 1.5 * iqr) | (prices > q3 + 1.5 * iqr)
+
+    result: Dict[str, Any] = {
+        "count": int(prices.size),
+        "price_usd": {
+            "mean": round(float(prices.mean()), 2),
+            "std": round(float(prices.std()), 2),
+            "min": float(prices.min()),
+            "max": float(prices.max()),
+            "percentiles": {f"p{p}": float(v) for p, v in zip(MARKET_PERCENTILES, q)},
+        },
+        "outliers": {
+            "count": int(outlier_mask.sum()),
+            "low_below": float(q1 - 1.5 * iqr),
+            "high_above": float(q3 + 1.5 * iqr),
+            "ids": ids[outlier_mask][:MARKET_MAX_OUTLIERS].astype(int).tolist(),
+        },
+    }
+
+    with_mileage = ~np.isnan(mileages)
+    if with_mileage.sum() >= 2 and np.ptp(mileages[with_mileage]) > 0:
+        x, y = mileages[with_mileage], prices[with_mileage]
+        slope, intercept = np.polyfit(x, y, 1)
+        residuals = y - (slope * x + intercept)
+        total_var = ((y - y.mean()) ** 2).sum()
+        result["price_vs_mileage"] = {
+            "usd_per_1000_km": round(float(slope), 2),
+            "intercept_usd": round(float(intercept), 2),
+            "r2": round(float(1 - (residuals ** 2).sum() / total_var), 4) if total_var else None,
+        }
+
+    with_year = ~np.isnan(years)
+    if with_year.any():
+        result["by_year"] = _group_stats(years[with_year].astype(int), prices[with_year])
+    with_region = ~np.isnan(regions)
+    if with_region.any():
+        result["by_state"] = _group_stats(regions[with_region].astype(int), prices[with_region])
+    return result
+
+
+@mcp.tool()
+@instrumented
+def market_stats(
+    auto_ids: Optional[List[int]] = None,
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+    marka_id: Optional[int] = None,
+    model_id: Optional[int] = None,
+    state_id: Optional[int] = None
 ) -> Dict[str, Any]:
     """
-    Пошук автомобільних оголошень через AUTO.RIA API
+    Статистика ринку по оголошеннях з локального сховища (після search_cars/sync_listings)
 
     Args:
-        category_id: ID категорії (1 - легкові авто, 2 - мото, 3 - вантажівки, 4 - автобуси, 5 - причепи, 6 - с/г техніка, 7 - спецтехніка, 8 - водний транспорт, 9 - повітряний транспорт)
-        s_yers: Рік випуску від (список років)
-        po_yers: Рік випуску до (список років)
-        price_ot: Ціна від
-        price_do: Ціна до
-        currency: Валюта (1 - USD, 2 - EUR, 3 - UAH)
-        auctionPossible: Можливість аукціону (0 - ні, 1 - так)
-        exchangePossible: Можливість обміну (0 - ні, 1 - так)
-        with_exchange_type: Тип обміну (1 - авто, 2 - нерухомість, 3 - комерція)
-        credit_possible: Можливість кредиту (0 - ні, 1 - так)
-        under_credit: Під кредитом (0 - ні, 1 - так)
-        confiscated_car: Конфісковане авто (0 - ні, 1 - так)
-        custom_cleared: Розмитнене (0 - ні, 1 - так)
-        page: Номер сторінки (початок з 0)
-        countpage: Кількість записів на сторінку (макс 100)
-        auto_id: ID конкретного авто
-        marka_id: ID марки авто (список)
-        model_id: ID моделі авто (список)
-        city_id: ID міста (список)
-        state_id: ID області (список)
-        gear_id: ID коробки передач (список: 1 - ручна, 2 - автомат, 3 - типтронік, 4 - адаптивна, 5 - варіатор)
-        drive_id: ID приводу (список: 1 - передній, 2 - задній, 3 - повний)
-        fuel_id: ID типу палива (список)
-        engineVolume_ot: Об'єм двигуна від (л)
-        engineVolume_do: Об'єм двигуна до (л)
-        power_ot: Потужність від (к.с.)
-        power_do: Потужність до (к.с.)
-        raceInt_ot: Пробіг від (тис. км)
-        raceInt_do: Пробіг до (тис. км)
-        bodystyle_id: ID типу кузова (список)
-        color_id: ID кольору (список)
-        verified: Перевірені оголошення (0 - ні, 1 - так)
+        auto_ids: Обмежити розрахунок цими оголошеннями (наприклад, результатом search_cars_all)
+        year_min/year_max: Рік випуску від/до
+        marka_id: ID марки
+        model_id: ID моделі
+        state_id: ID області
 
     Returns:
-        Словник з результатами пошуку
+        Перцентилі цін, регресія ціна/пробіг, розбивка за роками та областями, викиди
     """
-    if not api_key:
-        return {"error": "API ключ не встановлено. Використайте set_api_key() спочатку"}
+    if listing_store is None:
+        return {"success": False, "error": STORE_DISABLED_ERROR}
+    try:
+        import numpy as np
+    except ImportError:
+        return {"success": False, "error": "Для market_stats потрібен пакет numpy"}
 
-    # Формуємо базові параметри запиту
-    params = {
-        "api_key": api_key,
-        "category_id": category_id,
-        "page": page,
-        "countpage": countpage
-    }
+    where = listing_conditions(year_min=year_min, year_max=year_max, marka_id=marka_id,
+                               model_id=model_id, state_id=state_id)
+    rows = listing_store.load_columns(("price_usd", "year", "mileage", "state_id"), where, auto_ids)
+    # None -> NaN, одна конвертація для всіх колонок
+    table = np.array(rows, dtype=float).reshape(-1, 5)
+    stats = compute_market_stats(*table.T)
+    if auto_ids is not None:
+        stats["missing_in_store"] = len(set(auto_ids)) - len(rows)
+    return {"success": True, **stats}
 
-    # Додаємо прості параметри
-    if price_ot is not None:
-        params["price_ot"] = price_ot
-    if price_do is not None:
-        params["price_do"] = price_do
-    if currency != 1:
-        params["currency"] = currency
-    if auctionPossible is not None:
-        params["auctionPossible"] = auctionPossible
-    if exchangePossible is not None:
-        params["exchangePossible"] = exchangePossible
-    if with_exchange_type is not None:
-        params["with_exchange_type"] = with_exchange_type
-    if credit_possible is not None:
-        params["credit_possible"] = credit_possible
-    if under_credit is not None:
-        params["under_credit"] = under_credit
-    if confiscated_car is not None:
-        params["confiscated_car"] = confiscated_car
-    if custom_cleared is not None:
-        params["custom_cleared"] = custom_cleared
-    if auto_id is not None:
-        params["auto_id"] = auto_id
-    if engineVolume_ot is not None:
-        params["engineVolume_ot"] = engineVolume_ot
-    if engineVolume_do is not None:
-        params["engineVolume_do"] = engineVolume_do
-    if power_ot is not None:
-        params["power_ot"] = power_ot
-    if power_do is not None:
-        params["power_do"] = power_do
-    if raceInt_ot is not None:
-        params["raceInt_ot"] = raceInt_ot
-    if raceInt_do is not None:
-        params["raceInt_do"] = raceInt_do
-    if verified is not None:
-        params["verified"] = verified
 
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # Формуємо параметри для GET запиту
-            # Спочатку спробуємо стандартний підхід з множинними параметрами
-            query_params = []
-
-            for key, value in params.items():
-                query_params.append((key, str(value)))
-
-            add_array_params("s_yers", s_yers)
-            add_array_params("po_yers", po_yers)
-            add_array_params("marka_id", marka_id)
-            add_array_params("model_id", model_id)
-            add_array_params("city_id", city_id)
-            add_array_params("state_id", state_id)
-            add_array_params("gear_id", gear_id)
-            add_array_params("drive_id", drive_id)
-            add_array_params("fuel_id", fuel_id)
-            add_array_params("bodystyle_id", bodystyle_id)
-            add_array_params("color_id", color_id)
-
-            # Виконуємо запит з параметрами у форматі list of tuples
-            response = await client.get(f"{BASE_URL}/search", params=query_params)
-
-            # Для дебагу - виводимо фінальний URL
-            print(f"Request URL: {response.url}")
+# ---------- уточнення та ранжування оголошень ----------
+REFINE_TEXT_COLUMNS = ("city", "title")
+REFINE_MAX_LIMIT = 500
+# Оголошення з однаковими маркою, моделлю, роком, пробігом та містом вважаються одним авто,
+# виставленим повторно; лишається найновіше (найбільший auto_id)
+RELIST_KEY = ("marka_id", "model_id", "year", "mileage", "city")
 
-            response.raise_for_status()
-            data = response.json()
 
-            return {
-                "success": True,
-                "total_count": data.get("count", 0),
-                "page": page,
-                "countpage": countpage,
-                "cars": data.get("result", []),
-                "request_url": str(response.url)  # Для дебагу
-            }
+class ListingTable:
+    """
+    Оголошення як масиви NumPy: числові колонки - float64 (NaN для пропусків),
+    текстові - відсортовані категорії та коди int32, тож умови по тексту рахуються по категоріях
+    """
 
-    except httpx.HTTPError as e:
-        return {
-            "success": False,
-            "error": f"HTTP помилка: {str(e)}",
-            "status_code": getattr(e.response, 'status_code', None) if hasattr(e, 'response') else None
-        }
-    except Exception as e:
-        return {
-            "success": False,
-            "error": f"Загальна помилка: {str(e)}"
-        }
+    def __init__(self, rows: List[tuple]):
+        import numpy as np
 
+        columns = list(zip(*rows)) if rows else [()] * (1 + len(STORE_COLUMNS))
+        self.size = len(rows)
+        self.ids = np.array(columns[0], dtype=np.int64)
+        self.numeric: Dict[str, Any] = {}
+        self.text: Dict[str, Tuple[Any, Any]] = {}
+        for name, values in zip(STORE_COLUMNS, columns[1:]):
+            if name in REFINE_TEXT_COLUMNS:
+                categories, codes = np.unique(np.array([v or "" for v in values], dtype=str), return_inverse=True)
+                self.text[name] = (categories, codes.astype(np.int32))
+            else:
+                self.numeric[name] = np.array(values, dtype=float)
 
-@mcp.tool()
-async def search_cars(
-    *,
-    category_id: int = 1,
-    s_yers: Optional[List[int]] = None,
-    po_yers: Optional[List[int]] = None,
-    price_ot: Optional[int] = None,
-    price_do: Optional[int] = None,
-    currency: int = 1,
-    auctionPossible: Optional[int] = None,
-    exchangePossible: Optional[int] = None,
-    with_exchange_type: Optional[int] = None,
-    credit_possible: Optional[int] = None,
-    under_credit: Optional[int] = None,
-    confiscated_car: Optional[int] = None,
-    custom_cleared: Optional[int] = None,
-    page: int = 0,
-    countpage: int = 20,
-    auto_id: Optional[int] = None,
-    marka_id: Optional[List[int]] = None,
-    model_id: Optional[List[int]] = None,
-    city_id: Optional[List[int]] = None,
-    state_id: Optional[List[int]] = None,
-    gear_id: Optional[List[int]] = None,
-    drive_id: Optional[List[int]] = None,
-    fuel_id: Optional[List[int]] = None,
-    engineVolume_ot: Optional[float] = None,
-    engineVolume_do: Optional[float] = None,
-    power_ot: Optional[int] = None,
-    power_do: Optional[int] = None,
-    raceInt_ot: Optional[int] = None,
-    raceInt_do: Optional[int] = None,
-    bodystyle_id: Optional[List[int]] = None,
-    color_id: Optional[List[int]] = None,
-    verified: Optional[int] = None
-) -> Dict[str, Any]:
+    def mask(self, field: str, op: str, value: Any) -> Any:
+        """
+        Булева маска рядків для умови (поле, оператор, значення); пропущені значення не проходять
+        """
+        import numpy as np
+
+        if field in self.numeric:
+            column = self.numeric[field]
+            if op in ("in", "not_in"):
+                found = np.isin(column, np.asarray(value, dtype=float))
+                return found if op == "in" else ~found & ~np.isnan(column)
+            if op not in REFINE_COMPARE:
+                raise ValueError(f"Оператор {op} не підтримується для числового поля {field}")
+            with np.errstate(invalid="ignore"):
+                return REFINE_COMPARE[op](column, float(value)) & ~np.isnan(column)
+
+        if field in self.text:
+            categories, codes = self.text[field]
+            lowered = np.char.lower(categories)
+            if op == "contains":
+                matched = np.char.find(lowered, str(value).lower()) >= 0
+            elif op in ("=", "!=", "in", "not_in"):
+                values = value if op in ("in", "not_in") else [value]
+                matched = np.isin(lowered, [str(v).lower() for v in values])
+                if op in ("!=", "not_in"):
+                    matched = ~matched & (categories != "")
+            else:
+                raise ValueError(f"Оператор {op} не підтримується для текстового поля {field}")
+            return matched[codes]
+
+        raise ValueError(f"Невідоме поле: {field} (допустимі: {', '.join(STORE_COLUMNS)})")
+
+    def sort_key(self, field: str) -> Any:
+        if field in self.numeric:
+            return self.numeric[field]
+        if field in self.text:
+            return self.text[field][1]
+        raise ValueError(f"Невідоме поле сортування: {field}")
+
+    def rows(self, index: Any) -> List[Dict[str, Any]]:
+        """
+        Компактні записи (як у query_listings) для вибраних рядків
+        """
+        columns = [self.ids[index].tolist()]
+        for name in STORE_COLUMNS:
+            if name in self.text:
+                categories, codes = self.text[name]
+                columns.append([v or None for v in categories[codes[index]].tolist()])
+            else:
+                columns.append([None if v != v else int(v) for v in self.numeric[name][index].tolist()])
+        return [dict(zip(("id",) + STORE_COLUMNS, row)) for row in zip(*columns)]
+
+
+REFINE_COMPARE: Dict[str, Callable[[Any, float], Any]] = {
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+def _relist_survivors(table: ListingTable, index: Any) -> Any:
     """
-    Пошук оголошень AUTO.RIA. Параметри див. докстрінг вище.
+    Прибирає з index повторно виставлені авто (однаковий RELIST_KEY), лишаючи найбільший auto_id
     """
+    import numpy as np
 
-    # ---------- валідація ----------
-    if not api_key:
-        return {"success": False,
-                "error": "API ключ не встановлено; спершу викличте set_api_key()"}
-    if s_yers and po_yers and len(s_yers) != len(po_yers):
-        return {"success": False,
-                "error": "s_yers і po_yers повинні бути однакової довжини"}
+    keys = [table.sort_key(field)[index] for field in RELIST_KEY]
+    # Без року чи пробігу авто не можна впізнати - такі рядки лишаються як є
+    known = ~np.isnan(table.numeric["year"][index]) & ~np.isnan(table.numeric["mileage"][index])
+    candidates = index[known]
+    keys = [np.nan_to_num(k[known], nan=-1.0) for k in keys]
+    order = np.lexsort([-table.ids[candidates]] + keys[::-1])
+    first = np.ones(order.size, dtype=bool)
+    if order.size > 1:
+        first[1:] = np.any([k[order][1:] != k[order][:-1] for k in keys], axis=0)
+    return np.sort(np.concatenate((index[~known], candidates[order][first])))
 
-    # ---------- базові параметри ----------
-    params: Dict[str, Any] = {
-        "api_key": api_key,
-        "category_id": category_id,
-        "page": page,
-        "countpage": min(countpage, 100)  # API ліміт
-    }
 
-    # ---------- скалярні опції ----------
-    scalar_map = {
-        "price_ot": price_ot,
-        "price_do": price_do,
-        "currency": currency if currency != 1 else None,
-        "auctionPossible": auctionPossible,
-        "exchangePossible": exchangePossible,
-        "with_exchange_type": with_exchange_type,
-        "credit_possible": credit_possible,
-        "under_credit": under_credit,
-        "confiscated_car": confiscated_car,
-        "custom_cleared": custom_cleared,
-        "auto_id": auto_id,
-        "engineVolume_ot": engineVolume_ot,
-        "engineVolume_do": engineVolume_do,
-        "power_ot": power_ot,
-        "power_do": power_do,
-        "raceInt_ot": raceInt_ot,
-        "raceInt_do": raceInt_do,
-        "verified": verified
-    }
-    params.update({k: v for k, v in scalar_map.items() if v is not None})
-
-    # ---------- спискові опції ----------
-    add_array_params(params, "s_yers", s_yers)
-    add_array_params(params, "po_yers", po_yers)
-    add_array_params(params, "marka_id", marka_id)
-    add_array_params(params, "model_id", model_id)
-    add_array_params(params, "city_id", city_id)
-    add_array_params(params, "state_id", state_id)
-    add_array_params(params, "gear_id", gear_id)
-    add_array_params(params, "drive_id", drive_id)
-    add_array_params(params, "fuel_id", fuel_id)
-    add_array_params(params, "bodystyle_id", bodystyle_id)
-    add_array_params(params, "color_id", color_id)
+def refine_table(
+    table: ListingTable,
+    where: Optional[List[Dict[str, Any]]] = None,
+    sort_by: Optional[List[str]] = None,
+    score: Optional[Dict[str, float]] = None,
+    dedupe: bool = True,
+    auto_ids: Optional[List[int]] = None,
+    limit: int = 50,
+    offset: int = 0
+) -> Dict[str, Any]:
+    """
+    Фільтр, дедуплікація, сортування або top-k за оцінкою над ListingTable (NumPy)
 
-    # ---------- HTTP запит ----------
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            resp = await client.get(f"{BASE_URL}/search", params=params)
-            resp.raise_for_status()
-            data = resp.json()
+    score - ваги числових полів: оцінка = сума вага * z-оцінка поля, тож {"price_usd": -1,
+    "mileage": -0.5, "year": 1} віддає перевагу дешевшим, новішим і з меншим пробігом.
+    """
+    import numpy as np
 
-        return {
-            "success": True,
-            "total_count": data.get("count", 0),
-            "cars": data.get("result", []),
-            "page": page,
-            "countpage": countpage,
-            "request_url": str(resp.url)  # корисно для дебагу
-        }
+    mask = np.ones(table.size, dtype=bool)
+    if auto_ids is not None:
+        mask &= np.isin(table.ids, np.asarray(auto_ids, dtype=np.int64))
+    for condition in where or []:
+        mask &= table.mask(condition.get("field", ""), condition.get("op", "="), condition.get("value"))
+    index = np.flatnonzero(mask)
+    matched = int(index.size)
+    if dedupe and index.size:
+        index = _relist_survivors(table, index)
 
-    except httpx.HTTPStatusError as e:
-        return {
-            "success": False,
-            "error": f"HTTP {e.response.status_code}: {e.response.text}"
-        }
-    except Exception as e:
-        return {
-            "success": False,
-            "error": f"Неочікувана помилка: {e}"
-        }
+    scores = None
+    if score:
+        scores = np.zeros(index.size)
+        for field, weight in score.items():
+            if field not in table.numeric:
+                raise ValueError(f"Оцінка можлива лише за числовими полями, не {field}")
+            column = table.numeric[field][index]
+            std = np.nanstd(column) if index.size else 0.0
+            if std > 0:
+                scores += weight * (column - np.nanmean(column)) / std
+        scores = np.nan_to_num(scores, nan=-np.inf)  # рядки без потрібних полів - в кінець
+
+    window = offset + limit
+    if scores is not None and not sort_by and 0 < window < index.size:
+        # top-k: частковий розподіл за O(n), сортуються лише window найкращих
+        top = np.argpartition(-scores, window - 1)[:window]
+        order = top[np.argsort(-scores[top], kind="stable")]
+    else:
+        keys = []
+        for field in reversed(sort_by or []):
+            descending = field.startswith("-")
+            key = table.sort_key(field.lstrip("-"))[index]
+            keys.append(-key if descending else key)
+        if scores is not None:
+            keys.append(-scores)
+        order = np.lexsort(keys) if keys else np.arange(index.size)
+    order = order[offset:window]
+
+    listings = table.rows(index[order])
+    if scores is not None:
+        for listing, value in zip(listings, scores[order].tolist()):
+            listing["score"] = round(value, 4) if np.isfinite(value) else None
+    return {"matched": matched, "duplicates_removed": matched - int(index.size),
+            "count": int(index.size), "listings": listings}
 
 
 @mcp.tool()
-async def get_car_info(auto_id: int) -> Dict[str, Any]:
+@instrumented
+def refine_listings(
+    auto_ids: Optional[List[int]] = None,
+    where: Optional[List[Dict[str, Any]]] = None,
+    sort_by: Optional[List[str]] = None,
+    score: Optional[Dict[str, float]] = None,
+    dedupe: bool = True,
+    limit: int = 50,
+    offset: int = 0
+) -> Dict[str, Any]:
     """
-    Отримує детальну інформацію про конкретне авто за його ID
+    Уточнення та ранжування завантажених оголошень на сервері (замість фільтрації в контексті моделі)
+
+    Працює з локальним сховищем (після search_cars_all + get_cars_info або sync_listings).
 
     Args:
-        auto_id: ID автомобіля з AUTO.RIA
+        auto_ids: Обмежити вибірку цими оголошеннями (наприклад, результатом search_cars_all)
+        where: Умови [{"field": "price_usd", "op": "<=", "value": 20000}, {"field": "city", "op": "in", "value": ["Київ", "Львів"]}];
+               оператори: =, !=, <, <=, >, >=, in, not_in, contains (для city, title)
+        sort_by: Поля сортування за пріоритетом, "-" на початку - за спаданням: ["-year", "price_usd"]
+        score: Ваги для оцінки за z-оцінками полів, напр. {"price_usd": -1, "mileage": -0.5, "year": 1};
+               результати впорядковуються за оцінкою (sort_by - для рівних оцінок)
+        dedupe: Прибрати повторно виставлені авто (та сама марка, модель, рік, пробіг, місто)
+        limit: Кількість записів (макс 500)
+        offset: Зсув для пагінації
 
     Returns:
-        Словник з детальною інформацією про авто
+        Кількість знайдених, прибраних дублікатів та компактні записи (з полем score, якщо задано score)
     """
-    if not api_key:
-        return {"error": "API ключ не встановлено. Використайте set_api_key() спочатку"}
-
+    if listing_store is None:
+        return {"success": False, "error": STORE_DISABLED_ERROR}
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{BASE_URL}/info",
-                params={"api_key": api_key, "auto_id": auto_id}
-            )
-            response.raise_for_status()
+        import numpy as np  # noqa: F401
+    except ImportError:
+        return {"success": False, "error": "Для refine_listings потрібен пакет numpy"}
 
-            return {
-                "success": True,
-                "car_info": response.json()
-            }
+    try:
+        result = refine_table(listing_store.table(), where, sort_by, score, dedupe, auto_ids,
+                              max(0, min(limit, REFINE_MAX_LIMIT)), max(0, offset))
+    except (ValueError, TypeError) as e:
+        return {"success": False, "error": str(e)}
+    return {"success": True, **result}
 
-    except httpx.HTTPError as e:
-        return {
-            "success": False,
-            "error": f"HTTP помилка: {str(e)}"
-        }
-    except Exception as e:
-        return {
-            "success": False,
-            "error": f"Загальна помилка: {str(e)}"
-        }
 
 @mcp.tool()
+@instrumented
 async def get_average_price(
     marka_id: int,
     model_id: int,
@@ -409,11 +3454,14 @@ async def get_average_price(
     Returns:
         Словник з інформацією про середню ціну
     """
-    if not api_key:
+    import httpx
+
+    key = get_api_key()
+    if not key:
         return {"error": "API ключ не встановлено. Використайте set_api_key() спочатку"}
 
     params = {
-        "api_key": api_key,
+        "api_key": key,
         "marka_id": marka_id,
         "model_id": model_id,
         "yers": yers
@@ -427,14 +3475,12 @@ async def get_average_price(
         params["fuel_id"] = fuel_id
 
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(f"{BASE_URL}/average_price", params=params)
-            response.raise_for_status()
+        average_price_info = await fetch_upstream("average_price", params)
 
-            return {
-                "success": True,
-                "average_price_info": response.json()
-            }
+        return {
+            "success": True,
+            "average_price_info": average_price_info
+        }
 
     except httpx.HTTPError as e:
         return {
@@ -447,8 +3493,254 @@ async def get_average_price(
             "error": f"Загальна помилка: {str(e)}"
         }
 
+AVERAGE_PRICE_KEYS = ("marka_id", "model_id", "yers", "gear_id", "fuel_id", "race_id")
+AVERAGE_PRICE_VALUES = ("total", "arithmeticMean", "interQuartileMean")
+AVERAGE_PRICE_MAX_CELLS = 1000
+
+
+@mcp.tool()
+@instrumented
+async def get_average_price_matrix(
+    cells: List[Dict[str, int]],
+    years: Optional[List[int]] = None,
+    gear_ids: Optional[List[int]] = None,
+    fuel_ids: Optional[List[int]] = None,
+    max_concurrency: int = BATCH_MAX_CONCURRENCY
+) -> Dict[str, Any]:
+    """
+    Середні ціни для сітки параметрів одним викликом (паралельно, з дедуплікацією)
+
+    Тривалість обмежує ліміт запитів ключа, а не паралельність: кожна клітинка, якої немає в кеші, -
+    окремий запит, тож N таких клітинок займають близько N / AUTO_RIA_RATE_PER_SECOND секунд
+    (500 клітинок за замовчуванням, 5 запитів/с, - близько 100 с).
+
+    Args:
+        cells: Клітинки сітки: словники з marka_id, model_id та опціонально yers, gear_id, fuel_id, race_id
+        years: Роки, для яких розгорнути кожну клітинку (замість yers у клітинці)
+        gear_ids: ID коробок передач для розгортання кожної клітинки
+        fuel_ids: ID типів палива для розгортання кожної клітинки
+        max_concurrency: Максимальна кількість одночасних запитів до API
+
+    Returns:
+        Компактна матриця: назви колонок, рядки значень та помилки за номером рядка
+    """
+    key = get_api_key()
+    if not key:
+        return {"success": False,
+                "error": "API ключ не встановлено; спершу викличте set_api_key()"}
+
+    # Розгортаємо сітку і прибираємо однакові комбінації, зберігаючи порядок
+    expanded: Dict[Tuple[Optional[int], ...], None] = {}
+    for cell in cells:
+        unknown = set(cell) - set(AVERAGE_PRICE_KEYS)
+        if unknown or "marka_id" not in cell or "model_id" not in cell:
+            return {"success": False,
+                    "error": f"Некоректна клітинка {cell}: потрібні marka_id, model_id; "
+                             f"допустимі ключі: {', '.join(AVERAGE_PRICE_KEYS)}"}
+        for year in years or [cell.get("yers")]:
+            for gear in gear_ids or [cell.get("gear_id")]:
+                for fuel in fuel_ids or [cell.get("fuel_id")]:
+                    expanded[(cell["marka_id"], cell["model_id"], year, gear, fuel, cell.get("race_id"))] = None
+    rows_keys = list(expanded)
+    if any(key[2] is None for key in rows_keys):
+        return {"success": False, "error": "Для кожної клітинки потрібен рік (yers у клітинці або years)"}
+    if len(rows_keys) > AVERAGE_PRICE_MAX_CELLS:
+        return {"success": False,
+                "error": f"Забагато клітинок: {len(rows_keys)} (макс {AVERAGE_PRICE_MAX_CELLS})"}
+
+    semaphore = asyncio.Semaphore(max(1, min(max_concurrency, HTTP_MAX_CONNECTIONS)))
+
+    async def fetch_cell(row_key: Tuple[Optional[int], ...]) -> Any:
+        params: Dict[str, Any] = {"api_key": key}
+        params.update({name: value for name, value in zip(AVERAGE_PRICE_KEYS, row_key) if value is not None})
+        async with semaphore:
+            return await fetch_upstream("average_price", params)
+
+    results = await asyncio.gather(*(fetch_cell(k) for k in rows_keys), return_exceptions=True)
+
+    rows: List[List[Any]] = []
+    errors: Dict[str, str] = {}
+    for idx, (row_key, result) in enumerate(zip(rows_keys, results)):
+        if isinstance(result, Exception):
+            errors[str(idx)] = format_upstream_error(result)
+            rows.append([*row_key, *(None for _ in AVERAGE_PRICE_VALUES)])
+        else:
+            rows.append([*row_key, *(result.get(name) for name in AVERAGE_PRICE_VALUES)])
+
+    return {
+        "success": len(errors) < len(rows),
+        "requested": len(cells),
+        "unique_cells": len(rows),
+        "columns": [*AVERAGE_PRICE_KEYS, *AVERAGE_PRICE_VALUES],
+        "rows": rows,
+        "errors": errors
+    }
+
+@mcp.tool()
+@instrumented
+async def resolve_ids(
+    marka: Optional[str] = None,
+    model: Optional[str] = None,
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    fuel: Optional[str] = None,
+    bodystyle: Optional[str] = None,
+    color: Optional[str] = None,
+    gear: Optional[str] = None,
+    drive: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Знаходить ID AUTO.RIA за назвами (марка, модель, місто, ...) у локальних довідниках
+
+    Args:
+        marka: Назва марки, наприклад "BMW"
+        model: Назва моделі (потребує marka), наприклад "X5"
+        state: Назва області
+        city: Назва міста, наприклад "Київ"
+        fuel: Тип палива, наприклад "Дизель"
+        bodystyle: Тип кузова, наприклад "Седан"
+        color: Колір
+        gear: Коробка передач
+        drive: Тип приводу
+
+    Returns:
+        Знайдені ID, готові параметри для search_cars та підказки для нерозпізнаних назв
+    """
+    key = get_api_key()
+    if key and not reference_index.get("marka"):
+        try:
+            await reference_index.refresh(key)
+        except Exception as e:
+            return {"success": False, "error": f"Не вдалося завантажити довідники: {e}"}
+    elif key and reference_index.is_stale():
+        reference_index.refresh_in_background(key)
+
+    queries = {"marka": marka, "state": state, "city": city, "fuel": fuel,
+               "bodystyle": bodystyle, "color": color, "gear": gear, "drive": drive}
+    resolved: Dict[str, Any] = {}
+    suggestions: Dict[str, Any] = {}
+
+    def resolve(kind: str, name: str, index: Optional[NameIndex]) -> None:
+        if index is None:
+            suggestions[kind] = "довідник не завантажено (потрібен API ключ)"
+            return
+        match = index.lookup(name)
+        if match is not None:
+            resolved[kind] = match
+            return
+        candidates = index.suggest(name)
+        # Єдиний збіг за префіксом ("дизел" -> "Дизель") вважаємо розпізнаним
+        if len(candidates) == 1 and normalize_name(candidates[0]["name"]).startswith(normalize_name(name)):
+            resolved[kind] = candidates[0]
+        else:
+            suggestions[kind] = candidates
+
+    for kind, name in queries.items():
+        if name:
+            resolve(kind, name, reference_index.get(kind))
+
+    if model:
+        if "marka" not in resolved:
+            suggestions["model"] = "для пошуку моделі потрібна розпізнана marka"
+        elif key:
+            try:
+                models = await reference_index.ensure_models(key, resolved["marka"]["id"])
+                resolve("model", model, models)
+            except Exception as e:
+                suggestions["model"] = f"Не вдалося завантажити моделі: {e}"
+        else:
+            resolve("model", model, reference_index.get(f"model:{resolved['marka']['id']}"))
+
+    return {
+        "success": not suggestions,
+        "resolved": resolved,
+        "search_params": {f"{kind}_id": [match["id"]] for kind, match in resolved.items()},
+        "suggestions": suggestions
+    }
+
+
+def bandwidth_stats() -> Dict[str, Any]:
+    """
+    Трафік до AUTO.RIA за ендпоінтами: байти на дроті й після розпакування, 304 та заощаджене ними
+    """
+    fields = {"bytes_wire": "wire_bytes", "bytes_body": "body_bytes",
+              "not_modified": "not_modified", "bytes_saved_not_modified": "not_modified_saved_bytes"}
+    endpoints: Dict[str, Dict[str, int]] = {}
+    for name, value in metrics.counters.items():
+        counter, _, endpoint = name.partition(".")
+        if counter in fields:
+            endpoints.setdefault(endpoint, dict.fromkeys(fields.values(), 0))[fields[counter]] = value
+    total = {field: sum(e[field] for e in endpoints.values()) for field in fields.values()}
+    # Без стиснення й умовних запитів - щонайменше body_bytes + not_modified_saved_bytes (304 - за стисненим розміром)
+    full = total["body_bytes"] + total["not_modified_saved_bytes"]
+    return {
+        "accept_encoding": accept_encoding(),
+        "conditional_requests": CONDITIONAL_REQUESTS,
+        **total,
+        "saved_bytes": full - total["wire_bytes"],
+        "saved_ratio": round(1 - total["wire_bytes"] / full, 4) if full else 0.0,
+        "endpoints": dict(sorted(endpoints.items())),
+    }
+
+
+@mcp.tool()
+@instrumented
+async def get_cache_stats() -> Dict[str, Any]:
+    """
+    Повертає статистику кешу відповідей AUTO.RIA (попадання, промахи, витіснення, 304 ревалідації),
+    кількість об'єднаних однакових запитів і трафік до API (стиснення, заощаджене умовними запитами)
+    """
+    return {
+        "cache": response_cache.stats(),
+        "negative_cache": negative_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "background_refreshes": len(background_refreshes),
+        "bandwidth": bandwidth_stats(),
+    }
+
+
+@mcp.tool()
+@instrumented
+async def get_rate_limit_stats() -> Dict[str, Any]:
+    """
+    Повертає стан ліміту запитів до AUTO.RIA для API ключа поточного клієнта
+    та загальну кількість ключів (стан інших ключів не показується)
+    """
+    return {
+        "rate_per_second": RATE_PER_SECOND,
+        "burst": RATE_BURST,
+        "queue_deadline": RATE_QUEUE_DEADLINE,
+        "sessions_with_keys": len(session_api_keys),
+        "http_clients": len(http_clients),
+        "rate_limit": rate_limiter.stats(get_api_key()),
+        "circuit_breakers": circuit_breakers.stats(),
+    }
+
+
+@mcp.tool()
+@instrumented
+async def get_server_stats() -> Dict[str, Any]:
+    """
+    Повертає гістограми латентності інструментів, фаз виклику (param_build, queue_wait,
+    connect, tls, upstream_wait, body_read, json_decode, serialize, retry_backoff) та
+    ендпоінтів AUTO.RIA API, а також лічильники статусів і помилок - щоб бачити, з чого складається p99
+    """
+    return {
+        "success": True,
+        **metrics.stats(),
+        "cache": response_cache.stats(),
+        "negative_cache": negative_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "circuit_breakers": circuit_breakers.stats(),
+        "bandwidth": bandwidth_stats(),
+        "watches": watch_scheduler.stats(get_api_key()),
+        "event_loop": loop_monitor.stats(),
+    }
+
+
 @mcp.tool()
-def get_search_help() -> str:
+@instrumented
+async def get_search_help() -> str:
     """
     Повертає довідкову інформацію про параметри пошуку AUTO.RIA
     """
@@ -458,9 +3750,23 @@ def get_search_help() -> str:
     Основні функції:
     1. set_api_key(key) - встановити API ключ
     2. search_cars(...) - пошук авто за параметрами (з списками)
+       search_cars_all(filters, max_results) - пошук по всіх сторінках одразу
+       search_cars_many(searches) - кілька пошуків паралельно, об'єднані ID без дублікатів
     3. search_cars_alternative(...) - спрощений пошук (одиничні значення)
     4. get_car_info(auto_id) - детальна інформація про авто
     5. get_average_price(...) - середня ціна авто
+       get_average_price_matrix(cells, years) - середні ціни для сітки параметрів одним викликом
+    6. get_cars_info(auto_ids) - детальна інформація про кілька авто одним викликом
+    7. get_cache_stats() - статистика кешу відповідей
+    8. get_rate_limit_stats() - стан лімітів запитів до API
+    9. resolve_ids(marka="BMW", city="Київ", ...) - ID марок, моделей, міст тощо за назвою
+    10. sync_listings(filters) - синхронізація оголошень з локальним сховищем
+    11. query_listings(...) - фільтр/сортування/підрахунок по локальному сховищу без запитів до API
+    12. market_stats(...) - перцентилі цін, ціна/пробіг, розбивка за роками та областями, викиди
+        refine_listings(where, sort_by, score) - фільтр, сортування, top-k за оцінкою, без дублікатів
+    13. get_server_stats() - гістограми латентності інструментів і фаз виклику (де з'являється p99)
+    14. watch_search(filters, interval) - стежити за пошуком на сервері (нові оголошення, зміни цін)
+        get_watch_events(since), list_watches(), unwatch_search(watch_id)
     
     Основні параметри пошуку:
     
@@ -508,5 +3814,92 @@ def get_search_help() -> str:
     return help_text
 
 
+
+# ---------- запуск ----------
+def create_listen_socket(host: str, port: int, reuse_port: bool) -> "socket.socket":
+    """
+    Сокет для HTTP воркера; з SO_REUSEPORT кілька процесів слухають той самий порт,
+    а ядро розподіляє між ними з'єднання
+    """
+    import socket
+
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_http_worker(transport: str, host: str, port: int, stateless: bool, reuse_port: bool) -> None:
+    """
+    Один процес мережевого сервера (uvicorn + MCP застосунок)
+    """
+    import uvicorn
+
+    app = mcp.http_app(transport=transport, stateless_http=stateless if transport != "sse" else None)
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="on"))
+    server.run(sockets=[create_listen_socket(host, port, reuse_port)])
+
+
+def run_http_workers(args: Any) -> None:
+    """
+    Запускає args.workers процесів на одному порту (SO_REUSEPORT) та чекає на їх завершення
+    """
+    import signal
+    import subprocess
+    import sys
+
+    env = dict(os.environ)
+    # Кеш спільний для всіх воркерів, а загальний ліміт запитів (швидкість і запас) ділиться між ними:
+    # keep-alive з'єднання клієнта лишається в одному воркері, тож одне з'єднання отримує 1/N квоти ключа
+    env.setdefault("AUTO_RIA_CACHE_BACKEND", "sqlite")
+    env["AUTO_RIA_RATE_PER_SECOND"] = str(RATE_PER_SECOND / args.workers)
+    env["AUTO_RIA_RATE_BURST"] = str(max(1, RATE_BURST // args.workers))
+    command = [sys.executable, os.path.abspath(__file__), "--transport", args.transport,
+               "--host", args.host, "--port", str(args.port), "--reuse-port"]
+    workers = [subprocess.Popen(command, env=env) for _ in range(args.workers)]
+
+    def stop(*_: Any) -> None:
+        for worker in workers:
+            worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for worker in workers:
+            worker.wait()
+    except KeyboardInterrupt:
+        stop()
+        for worker in workers:
+            worker.wait()
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="AUTO.RIA MCP Server")
+    parser.add_argument("--transport", choices=["stdio", "http", "sse"], default="stdio",
+                        help="stdio (за замовчуванням), http (Streamable HTTP) або sse")
+    parser.add_argument("--host", default=os.getenv("AUTO_RIA_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("AUTO_RIA_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("AUTO_RIA_WORKERS", "1")),
+                        help="кількість процесів (лише для --transport http)")
+    parser.add_argument("--reuse-port", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.transport == "stdio":
+        mcp.run()
+    elif args.workers > 1:
+        if args.transport != "http":
+            parser.error("--workers > 1 підтримується лише для --transport http")
+        run_http_workers(args)
+    else:
+        # Воркер у групі процесів працює без стану сесії: запити одного клієнта
+        # можуть потрапити в різні процеси (API ключ - у заголовку X-Auto-Ria-Api-Key)
+        run_http_worker(args.transport, args.host, args.port,
+                        stateless=args.reuse_port, reuse_port=args.reuse_port)
+
+
 if __name__ == "__main__":
-    mcp.run()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -6,14 +6,16 @@ from fastmcp import FastMCP
 
 mcp = FastMCP("Простий приклад 🚀")
 
+# Синхронні інструменти fastmcp виконує в пулі потоків; для таких дрібних функцій
+# перехід у потік дорожчий за саму роботу, тому вони async і виконуються прямо в event loop
 @mcp.tool()
-def return_pi() -> float:
+async def return_pi() -> float:
     """Повертає число PI"""
     return 3.1415926
 
 
 @mcp.tool()
-def add(a: int, b: int) -> int:
+async def add(a: int, b: int) -> int:
     """Add two numbers"""
     return a + b
 
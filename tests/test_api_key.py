@@ -0,0 +1,36 @@
+"""
+API ключ через MCP транспорти проти локальної заглушки AUTO.RIA (benchmarks/stub_server.py)
+Запуск: python3.12 -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+from fastmcp import Client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from common import bench_environment, load_server  # noqa: E402
+from stub_server import FixtureStore, start_stub  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def server():
+    stub, base_url = start_stub(fixtures=FixtureStore())
+    os.environ.update(bench_environment(base_url))
+    yield load_server()
+    stub.shutdown()
+
+
+def test_set_api_key_in_memory_client(server):
+    async def run():
+        async with Client(server.mcp) as client:
+            result = await client.call_tool("set_api_key", {"key": "test-key"})
+            assert result.structured_content["success"] is True
+            search = await client.call_tool("search_cars", {"marka_id": [9], "view": "compact"})
+            return search.structured_content
+
+    search = asyncio.run(run())
+    assert search["success"] is True, search
+    assert search["ids"]